@@ -0,0 +1,9 @@
+"""
+Benchmarks of the bibliography_organizer.
+
+Run them from the root of the repository, e.g.
+
+    python -m benchmarks.suite --sizes 1000 10000
+    python -m benchmarks.synthetic BIB_DIR --num-entries 1000
+    python -m benchmarks.ingest --num-pages 5000
+"""
@@ -0,0 +1,79 @@
+"""
+Compares the size and the query-latency of the layouts of the search-index:
+one document per original or per page, with and without the stored text.
+The indices are written into temporary directories, the index of the
+bibliography is not touched.
+
+    python benchmarks/index_layout.py BIB_DIR --query "neutrino" --query "x OR y"
+"""
+
+import bibliography_organizer as biborg
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+LAYOUTS = [
+    {"per_page": False, "store_content": True},
+    {"per_page": False, "store_content": False},
+    {"per_page": True, "store_content": True},
+    {"per_page": True, "store_content": False},
+]
+
+
+def time_queries(bib_dir, index_dir, queries, repetitions):
+    search = biborg.Index.Search(bib_dir=bib_dir, index_dir=index_dir)
+    start = time.perf_counter()
+    for repetition in range(repetitions):
+        for query in queries:
+            search.search(query)
+    return (time.perf_counter() - start) / (repetitions * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the layouts of the search-index."
+    )
+    parser.add_argument("bib_dir", metavar="BIB_DIR", type=str)
+    parser.add_argument(
+        "--query", metavar="PHRASE", action="append", default=[]
+    )
+    parser.add_argument("--repetitions", metavar="R", type=int, default=10)
+    args = parser.parse_args()
+    queries = args.query if args.query else ["the"]
+
+    snapshot = biborg.Snapshot.BibliographySnapshot(bib_dir=args.bib_dir)
+    print(
+        "{:>10s} {:>14s} {:>12s} {:>14s}".format(
+            "per_page", "store_content", "size/MB", "latency/ms"
+        )
+    )
+    for layout in LAYOUTS:
+        with tempfile.TemporaryDirectory() as index_dir:
+            with contextlib.redirect_stdout(io.StringIO()):
+                biborg.Index.make_clean_index(
+                    bib_dir=args.bib_dir,
+                    snapshot=snapshot,
+                    index_dir=index_dir,
+                    **layout
+                )
+            size = biborg.Index.get_index_size(index_dir)
+            latency = time_queries(
+                bib_dir=args.bib_dir,
+                index_dir=index_dir,
+                queries=queries,
+                repetitions=args.repetitions,
+            )
+        print(
+            "{:>10s} {:>14s} {:12.3f} {:14.3f}".format(
+                str(layout["per_page"]),
+                str(layout["store_content"]),
+                size * 1e-6,
+                latency * 1e3,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
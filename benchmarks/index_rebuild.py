@@ -0,0 +1,72 @@
+"""
+Compares the serial rebuild of the search-index with the rebuild in
+parallel segments. The indices are written into temporary directories,
+the index of the bibliography is not touched.
+
+    python benchmarks/index_rebuild.py BIB_DIR --jobs 4 --limitmb 256
+"""
+
+import bibliography_organizer as biborg
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+
+def time_clean_index(bib_dir, num_procs, limitmb, snapshot):
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            biborg.Index.make_clean_index(
+                bib_dir=bib_dir,
+                snapshot=snapshot,
+                num_procs=num_procs,
+                limitmb=limitmb,
+                index_dir=index_dir,
+            )
+        duration = time.perf_counter() - start
+        size = biborg.Index.get_index_size(index_dir)
+    return duration, size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the rebuild of the search-index."
+    )
+    parser.add_argument("bib_dir", metavar="BIB_DIR", type=str)
+    parser.add_argument("--jobs", metavar="N", type=int, default=4)
+    parser.add_argument("--limitmb", metavar="MB", type=int, default=128)
+    parser.add_argument("--repetitions", metavar="R", type=int, default=1)
+    args = parser.parse_args()
+
+    snapshot = biborg.Snapshot.BibliographySnapshot(bib_dir=args.bib_dir)
+    num_docs = len(
+        biborg.Index.list_all_docs_in_bibliography(
+            bib_dir=args.bib_dir, snapshot=snapshot
+        )
+    )
+    print("{:d} documents in {:s}".format(num_docs, args.bib_dir))
+    print(
+        "{:>10s} {:>10s} {:>12s} {:>12s}".format(
+            "procs", "limitmb", "time/s", "size/MB"
+        )
+    )
+
+    for num_procs in [1, args.jobs]:
+        for repetition in range(args.repetitions):
+            duration, size = time_clean_index(
+                bib_dir=args.bib_dir,
+                num_procs=num_procs,
+                limitmb=args.limitmb,
+                snapshot=snapshot,
+            )
+            print(
+                "{:10d} {:10d} {:12.3f} {:12.3f}".format(
+                    num_procs, args.limitmb, duration, size * 1e-6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Measures the peak memory of adding one very long string-archive, e.g. of a
+scanned book, to the search-index. Fails when the peak exceeds --max-peak-mb
+or when the last page can not be found in the index.
+
+    python -m benchmarks.ingest [--num-pages 5000] [--max-peak-mb 256]
+
+The string-archive is synthetic, see benchmarks.synthetic. The indices are
+written into temporary directories.
+"""
+
+import bibliography_organizer as biborg
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import whoosh.index
+import whoosh.qparser
+from . import synthetic
+
+MARKER = "zzlastpagemarker"
+
+
+def make_archive(path, num_pages, words_per_page, seed=1):
+    """
+    Writes a string-archive with num_pages pages. Only the last page has
+    the MARKER. Returns the number of characters of all pages.
+    """
+    prng = random.Random(seed)
+    vocabulary = synthetic.make_vocabulary(prng, 20000)
+    pages = {}
+    for page_number in range(1, num_pages + 1):
+        pages[page_number] = synthetic.make_text(
+            prng, vocabulary, words_per_page
+        )
+    pages[num_pages] += " " + MARKER
+    biborg.Reader.write_string_archive(path=path, pages=pages)
+    return sum([len(page) for page in pages.values()])
+
+
+def measure(func):
+    """
+    Returns the wall-time in s and the peak of the memory allocated by
+    python in bytes while func runs.
+    """
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        duration = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return duration, peak
+
+
+def ingest(path, index_dir, per_page, limitmb):
+    index = whoosh.index.create_in(
+        index_dir, schema=biborg.Index.get_schema(per_page=per_page)
+    )
+    index_writer = biborg.Index.open_writer(index=index, limitmb=limitmb)
+    biborg.Index.add_doc(index_writer=index_writer, path=path, modtime=0.0)
+    index_writer.commit()
+
+
+def find_marker(index_dir):
+    index = whoosh.index.open_dir(index_dir)
+    with index.searcher() as searcher:
+        query = whoosh.qparser.QueryParser("content", index.schema).parse(
+            MARKER
+        )
+        return len(searcher.search(query)) > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the memory of indexing a very long document."
+    )
+    parser.add_argument("--num-pages", metavar="P", type=int, default=5000)
+    parser.add_argument("--words-per-page", metavar="W", type=int, default=400)
+    parser.add_argument("--limitmb", metavar="MB", type=int, default=128)
+    parser.add_argument("--max-peak-mb", metavar="MB", type=int, default=256)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The path of a string-archive in the index is citekey/ocr/*.tar
+        ocr_dir = os.path.join(tmp_dir, "book2020long", "ocr")
+        os.makedirs(ocr_dir)
+        path = os.path.join(ocr_dir, "book2020long.pdf.tar")
+        num_chars = make_archive(
+            path=path,
+            num_pages=args.num_pages,
+            words_per_page=args.words_per_page,
+        )
+        print(
+            "{:d} pages, {:.1f}M characters".format(
+                args.num_pages, num_chars * 1e-6
+            )
+        )
+
+        def join_pages():
+            with biborg.Reader.open_string_archive(path) as arc:
+                biborg.Index._join_pages(pages=biborg.Index._iter_pages(arc))
+
+        _, peak = measure(join_pages)
+        print("join pages: peak {:.1f}MB".format(peak * 1e-6))
+
+        print(
+            "{:>10s} {:>10s} {:>12s}".format("per_page", "time/s", "peak/MB")
+        )
+        for per_page in [False, True]:
+            index_dir = os.path.join(tmp_dir, "index_{:d}".format(per_page))
+            os.makedirs(index_dir)
+            duration, peak = measure(
+                lambda: ingest(
+                    path=path,
+                    index_dir=index_dir,
+                    per_page=per_page,
+                    limitmb=args.limitmb,
+                )
+            )
+            line = "{:>10s} {:10.2f} {:12.1f}".format(
+                str(per_page), duration, peak * 1e-6
+            )
+            if peak > args.max_peak_mb * 1e6:
+                line += "  ! peak above {:d}MB".format(args.max_peak_mb)
+                failed = True
+            if not find_marker(index_dir):
+                line += "  ! last page not in index"
+                failed = True
+            print(line)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
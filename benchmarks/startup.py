@@ -0,0 +1,132 @@
+"""
+Measures the wall-time of the 'bib' subcommands, and which of the slow
+to import modules they load. Fails when a subcommand imports a module it
+should not need, or when it got slower than in a saved baseline.
+
+    python benchmarks/startup.py [--bib-dir BIB_DIR] [--baseline PATH]
+    python benchmarks/startup.py --save-baseline PATH
+
+Without --bib-dir, the subcommands run in an empty, temporary bibliography.
+"""
+
+import bibliography_organizer as biborg
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SLOW_MODULES = ["whoosh", "pytesseract", "PIL"]
+
+SUBCOMMANDS = {
+    "status": {"argv": ["status"], "allowed": []},
+    "export-bibtex": {
+        "argv": ["export-bibtex", os.devnull, "-1"],
+        "allowed": [],
+    },
+    "search": {"argv": ["search", "the"], "allowed": ["whoosh"]},
+}
+
+TOLERANCE = 1.25
+
+
+def run_subcommand(bib_dir, argv):
+    """
+    Returns the wall-time of the subcommand and the top-level names of the
+    modules it imported.
+    """
+    package_dir = os.path.dirname(os.path.dirname(biborg.__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package_dir] + env.get("PYTHONPATH", "").split(os.pathsep)
+    )
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m"]
+        + ["bibliography_organizer.scripts.main"]
+        + argv,
+        cwd=bib_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    duration = time.perf_counter() - start
+
+    modules = set()
+    for line in proc.stderr.decode().splitlines():
+        if str.startswith(line, "import time:"):
+            name = str.strip(line.split("|")[-1])
+            modules.add(name.split(".")[0])
+    return duration, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the startup of the 'bib' subcommands."
+    )
+    parser.add_argument("--bib-dir", metavar="BIB_DIR", type=str)
+    parser.add_argument("--repetitions", metavar="R", type=int, default=5)
+    parser.add_argument("--baseline", metavar="PATH", type=str)
+    parser.add_argument("--save-baseline", metavar="PATH", type=str)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.bib_dir is None:
+            bib_dir = os.path.join(tmp_dir, "bib")
+            os.makedirs(bib_dir)
+            biborg.Bibliography.init(bib_dir=bib_dir)
+        else:
+            bib_dir = args.bib_dir
+
+        timings = {}
+        failed = False
+        print(
+            "{:>16s} {:>10s}  {:s}".format(
+                "subcommand", "time/s", "slow imports"
+            )
+        )
+        for name in SUBCOMMANDS:
+            subcommand = SUBCOMMANDS[name]
+            durations = []
+            for repetition in range(args.repetitions):
+                duration, modules = run_subcommand(
+                    bib_dir=bib_dir, argv=subcommand["argv"]
+                )
+                durations.append(duration)
+            durations.sort()
+            timings[name] = durations[len(durations) // 2]
+
+            slow = [m for m in SLOW_MODULES if m in modules]
+            print(
+                "{:>16s} {:10.3f}  {:s}".format(
+                    name, timings[name], ", ".join(slow)
+                )
+            )
+            for module in slow:
+                if module not in subcommand["allowed"]:
+                    print("  ! '{:s}' imports {:s}".format(name, module))
+                    failed = True
+
+    if args.baseline:
+        with open(args.baseline, "rt") as f:
+            baseline = json.loads(f.read())
+        for name in timings:
+            if name in baseline and timings[name] > TOLERANCE * baseline[name]:
+                print(
+                    "  ! '{:s}' is slower than baseline {:.3f}s".format(
+                        name, baseline[name]
+                    )
+                )
+                failed = True
+
+    if args.save_baseline:
+        with open(args.save_baseline, "wt") as f:
+            f.write(json.dumps(timings, indent=4))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Times the core functions on synthetic bibliographies of different sizes.
+Fails when a function got slower than in a saved baseline.
+
+    python -m benchmarks.suite [--sizes 1000 10000 100000] [--baseline PATH]
+    python -m benchmarks.suite --save-baseline PATH
+
+The bibliographies are generated with benchmarks.synthetic into a
+temporary directory, or into --work-dir to be reused by later runs. No
+ImageMagick or tesseract is needed.
+"""
+
+import bibliography_organizer as biborg
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from . import synthetic
+
+TOLERANCE = 1.25
+QUERIES = ["ma", "ma AND le", "author:ma*", "year:[1990 TO 2000]"]
+
+
+def timeit(func, repetitions=1):
+    """
+    Returns the median wall-time of func in s.
+    """
+    durations = []
+    for repetition in range(repetitions):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def get_bibliography(work_dir, num_entries):
+    bib_dir = os.path.join(work_dir, "{:d}".format(num_entries))
+    if not os.path.exists(bib_dir):
+        print("Generate {:d} entries in {:s}".format(num_entries, bib_dir))
+        synthetic.make_bibliography(bib_dir=bib_dir, num_entries=num_entries)
+    return bib_dir
+
+
+def run(bib_dir, repetitions):
+    """
+    Returns the wall-times of the functions on the bibliography in bib_dir.
+    """
+    t = {}
+    entry_dirs = biborg.Bibliography.list_entry_dirs(bib_dir=bib_dir)
+
+    t["Bibliography.list_entry_dirs"] = timeit(
+        lambda: biborg.Bibliography.list_entry_dirs(bib_dir=bib_dir),
+        repetitions,
+    )
+
+    def list_errors_in_entries():
+        for entry_dir in entry_dirs:
+            biborg.Status.list_errors_in_entry(entry_dir=entry_dir)
+
+    t["Status.list_errors_in_entry"] = timeit(list_errors_in_entries)
+
+    bibtex_cache_path = biborg.Bibtex.get_bibtex_cache_path(bib_dir)
+    if os.path.exists(bibtex_cache_path):
+        os.remove(bibtex_cache_path)
+    t["Bibtex.make_bib_file (cold)"] = timeit(
+        lambda: biborg.Bibtex.make_bib_file(bib_dir=bib_dir)
+    )
+    t["Bibtex.make_bib_file"] = timeit(
+        lambda: biborg.Bibtex.make_bib_file(bib_dir=bib_dir), repetitions
+    )
+
+    t["Index.make_clean_index"] = timeit(
+        lambda: biborg.Index.make_clean_index(bib_dir=bib_dir)
+    )
+    t["Index.increment_index (unchanged)"] = timeit(
+        lambda: biborg.Index.increment_index(bib_dir=bib_dir), repetitions
+    )
+
+    changed = entry_dirs[0 : max([1, len(entry_dirs) // 100])]
+
+    def touch_and_increment_index():
+        for entry_dir in changed:
+            os.utime(os.path.join(entry_dir, "reference.bib"))
+        biborg.Index.increment_index(bib_dir=bib_dir)
+
+    t["Index.increment_index (1% changed)"] = timeit(touch_and_increment_index)
+
+    search = biborg.Index.Search(bib_dir=bib_dir)
+
+    def search_queries():
+        for query in QUERIES:
+            search.search(query)
+
+    t["Index.Search.search"] = timeit(search_queries, repetitions) / len(
+        QUERIES
+    )
+    search.close()
+    return t
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the core functions on synthetic bibliographies."
+    )
+    parser.add_argument(
+        "--sizes",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+    )
+    parser.add_argument("--work-dir", metavar="PATH", type=str)
+    parser.add_argument("--repetitions", metavar="R", type=int, default=3)
+    parser.add_argument("--baseline", metavar="PATH", type=str)
+    parser.add_argument("--save-baseline", metavar="PATH", type=str)
+    args = parser.parse_args()
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = tmp_dir if args.work_dir is None else args.work_dir
+        for num_entries in args.sizes:
+            bib_dir = get_bibliography(work_dir, num_entries)
+            timings[str(num_entries)] = run(
+                bib_dir=bib_dir, repetitions=args.repetitions
+            )
+
+    failed = False
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "rt") as f:
+            baseline = json.loads(f.read())
+
+    print("{:>36s} {:>10s} {:>10s}".format("function", "entries", "time/s"))
+    for size in timings:
+        for name in timings[size]:
+            duration = timings[size][name]
+            line = "{:>36s} {:>10s} {:10.4f}".format(name, size, duration)
+            base = baseline.get(size, {}).get(name, None)
+            if base is not None and duration > TOLERANCE * base:
+                line += "  ! slower than baseline {:.4f}s".format(base)
+                failed = True
+            print(line)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "wt") as f:
+            f.write(json.dumps(timings, indent=4))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
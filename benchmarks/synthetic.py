@@ -0,0 +1,186 @@
+"""
+Generates a synthetic bibliography for benchmarks. Each entry has a
+'reference.bib', an original, an 'icon.jpg', and a pre-built string-archive
+in 'ocr'. Nothing needs to be rendered or recognized, so neither
+ImageMagick nor tesseract are needed.
+
+    python -m benchmarks.synthetic BIB_DIR --num-entries 1000
+"""
+
+import bibliography_organizer as biborg
+import argparse
+import os
+import random
+
+SYLLABLES = [
+    "ab", "ac", "al", "an", "ar", "ba", "be", "ca", "co", "da", "de", "di",
+    "el", "en", "er", "es", "fa", "ga", "ge", "in", "io", "is", "ka", "la",
+    "le", "li", "lo", "ma", "me", "mi", "mo", "na", "ne", "no", "on", "or",
+    "pa", "pe", "po", "ra", "re", "ri", "ro", "sa", "se", "si", "ta", "te",
+    "ti", "to", "tu", "ul", "um", "un", "ur", "us", "va", "ve", "vi", "xe",
+]  # fmt: skip
+
+JOURNALS = ["Nature", "Science", "Physical Review D", "ApJ", "A&A", "JINST"]
+
+# The smallest possible jpg: start- and end-of-image.
+ICON_BYTES = b"\xff\xd8\xff\xd9"
+
+
+def make_vocabulary(prng, num_words):
+    vocabulary = set()
+    while len(vocabulary) < num_words:
+        num_syllables = prng.randint(1, 4)
+        vocabulary.add(
+            str.join(
+                "", [prng.choice(SYLLABLES) for i in range(num_syllables)]
+            )
+        )
+    return sorted(vocabulary)
+
+
+def make_text(prng, vocabulary, num_words):
+    # Zipf-like, so that there are common and rare words.
+    words = []
+    for i in range(num_words):
+        rank = int(prng.paretovariate(1.0)) - 1
+        words.append(vocabulary[rank % len(vocabulary)])
+    return str.join(" ", words)
+
+
+def make_reference_bib(prng, vocabulary, citekey, author, year):
+    title = make_text(prng, vocabulary, prng.randint(4, 12)).capitalize()
+    return (
+        "@article{{{citekey:s},\n"
+        "  title = {{{title:s}}},\n"
+        "  author = {{{author:s}}},\n"
+        "  year = {{{year:d}}},\n"
+        "  journal = {{{journal:s}}},\n"
+        "  keywords = {{{keywords:s}}},\n"
+        "}}\n"
+    ).format(
+        citekey=citekey,
+        title=title,
+        author=author,
+        year=year,
+        journal=prng.choice(JOURNALS),
+        keywords=str.join(", ", prng.sample(vocabulary[0:100], 3)),
+    )
+
+
+def make_entry(
+    bib_dir, citekey, prng, vocabulary, author, year, num_pages, words_per_page
+):
+    entry_dir = os.path.join(bib_dir, citekey)
+    os.makedirs(os.path.join(entry_dir, "original"))
+    os.makedirs(os.path.join(entry_dir, "ocr"))
+
+    with open(os.path.join(entry_dir, "reference.bib"), "wt") as f:
+        f.write(
+            make_reference_bib(
+                prng=prng,
+                vocabulary=vocabulary,
+                citekey=citekey,
+                author=author,
+                year=year,
+            )
+        )
+    with open(os.path.join(entry_dir, "icon.jpg"), "wb") as f:
+        f.write(ICON_BYTES)
+
+    # The original is never rendered. It only has to exist and to be
+    # unique for the ocr-cache.
+    original_filename = citekey + ".pdf"
+    with open(
+        os.path.join(entry_dir, "original", original_filename), "wt"
+    ) as f:
+        f.write("{:d}\n{:s}\n".format(num_pages, citekey))
+
+    pages = {}
+    for page_number in range(1, num_pages + 1):
+        pages[page_number] = make_text(prng, vocabulary, words_per_page)
+    biborg.Reader.write_string_archive(
+        path=os.path.join(entry_dir, "ocr", original_filename + ".tar"),
+        pages=pages,
+    )
+    return entry_dir
+
+
+def make_bibliography(
+    bib_dir,
+    num_entries,
+    num_pages=3,
+    words_per_page=120,
+    vocabulary_size=20000,
+    seed=1,
+):
+    """
+    Writes a synthetic bibliography with num_entries entries into bib_dir
+    and initializes its hidden work-dir, but not its search-index.
+    Returns the list of entry_dirs.
+
+    The same seed gives the same bibliography.
+    Each entry takes about 40kB on disk, mostly the blocks of its five small
+    files and the padding of its string-archive.
+    """
+    prng = random.Random(seed)
+    vocabulary = make_vocabulary(prng, vocabulary_size)
+    surnames = [w.capitalize() for w in vocabulary[0:2000]]
+
+    os.makedirs(os.path.join(bib_dir, biborg.Bibliography.HIDDEN_WORK_DIRNAME))
+    os.makedirs(biborg.Index.get_index_dir(bib_dir))
+
+    citekeys = set()
+    entry_dirs = []
+    for i in range(num_entries):
+        surname = prng.choice(surnames)
+        year = prng.randint(1950, 2023)
+        citekey = "{:s}{:d}{:s}".format(
+            str.lower(surname), year, prng.choice(vocabulary)
+        )
+        while citekey in citekeys:
+            citekey += prng.choice(SYLLABLES)
+        citekeys.add(citekey)
+
+        author = "{:s}, {:s} and {:s}, {:s}".format(
+            surname,
+            prng.choice(surnames)[0],
+            prng.choice(surnames),
+            prng.choice(surnames)[0],
+        )
+        entry_dirs.append(
+            make_entry(
+                bib_dir=bib_dir,
+                citekey=citekey,
+                prng=prng,
+                vocabulary=vocabulary,
+                author=author,
+                year=year,
+                num_pages=num_pages,
+                words_per_page=words_per_page,
+            )
+        )
+    return sorted(entry_dirs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic bibliography for benchmarks."
+    )
+    parser.add_argument("bib_dir", metavar="BIB_DIR", type=str)
+    parser.add_argument("--num-entries", metavar="N", type=int, default=1000)
+    parser.add_argument("--num-pages", metavar="P", type=int, default=3)
+    parser.add_argument("--words-per-page", metavar="W", type=int, default=120)
+    parser.add_argument("--seed", metavar="S", type=int, default=1)
+    args = parser.parse_args()
+
+    make_bibliography(
+        bib_dir=args.bib_dir,
+        num_entries=args.num_entries,
+        num_pages=args.num_pages,
+        words_per_page=args.words_per_page,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,17 @@
 import os
 import glob
+import multiprocessing
+import concurrent.futures
 from . import Status
 from . import Bibtex
 from . import Entry
-from . import Index
 
 HIDDEN_WORK_DIRNAME = ".bibliography_organizer"
 
 
-def list_entry_dirs(bib_dir):
+def list_entry_dirs(bib_dir, snapshot=None):
+    if snapshot is not None:
+        return snapshot.list_entry_dirs()
     bib_dir = os.path.normpath(bib_dir)
     entry_dirs = glob.glob(os.path.join(bib_dir, "*"))
     entry_dirs.sort()
@@ -22,6 +25,189 @@ def init(bib_dir):
         f.write("icon.jpg\n")
         f.write("ocr\n")
 
+    from . import Index
+
     index_dir = Index.get_index_dir(bib_dir)
     os.makedirs(index_dir)
     Index.make_clean_index(bib_dir=bib_dir)
+
+
+def make_process_pool(num_jobs):
+    """
+    Returns a concurrent.futures.ProcessPoolExecutor with num_jobs workers.
+
+    The workers are started by a 'forkserver', or where there is none by
+    'spawn', but never by 'fork'. The pools are used next to threads, e.g.
+    the renderer in Reader.document_to_string_archive, and a worker forked
+    while another thread holds a lock inherits this lock locked forever.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return concurrent.futures.ProcessPoolExecutor(
+        max([1, num_jobs]), mp_context=context
+    )
+
+
+def update_entries(
+    entry_dirs, num_jobs=1, verbose=False, cache_dir=None, snapshot=None
+):
+    """
+    Updates the icon and the optical-character-recognition of the entries.
+
+    Parameters
+    ----------
+    entry_dirs : list of str
+            The entries to be updated.
+    num_jobs : int (1)
+            Number of processes to recognize characters in. When larger one,
+            different entries are updated at the same time, and the pages
+            of a single document are recognized in parallel.
+    cache_dir : str (None)
+            When given, string-archives are taken from, and put into this
+            content-addressed cache. See OcrCache.
+    snapshot : Snapshot.BibliographySnapshot (None)
+            When given, the entries are read from this snapshot.
+    """
+    if num_jobs <= 1:
+        for entry_dir in entry_dirs:
+            update_entry(
+                entry_dir=entry_dir,
+                pool=None,
+                verbose=verbose,
+                cache_dir=cache_dir,
+                snapshot=snapshot,
+            )
+        return
+
+    with make_process_pool(num_jobs) as ocr_pool:
+        with concurrent.futures.ThreadPoolExecutor(num_jobs) as entry_pool:
+            futures = []
+            for entry_dir in entry_dirs:
+                futures.append(
+                    entry_pool.submit(
+                        update_entry,
+                        entry_dir=entry_dir,
+                        pool=ocr_pool,
+                        verbose=verbose,
+                        cache_dir=cache_dir,
+                        snapshot=snapshot,
+                    )
+                )
+            for future in futures:
+                future.result()
+
+
+def make_icons(entry_dirs, num_jobs=1, verbose=False, snapshot=None):
+    """
+    Makes the icons of the entries which have none.
+
+    Parameters
+    ----------
+    entry_dirs : list of str
+            The entries to make icons for.
+    num_jobs : int (1)
+            Number of processes to make the icons in.
+    snapshot : Snapshot.BibliographySnapshot (None)
+            When given, the entries are read from this snapshot.
+    """
+    if num_jobs <= 1:
+        for entry_dir in entry_dirs:
+            Entry.make_icon(
+                entry_dir=entry_dir, verbose=verbose, snapshot=snapshot
+            )
+        return
+
+    with make_process_pool(num_jobs) as icon_pool:
+        with concurrent.futures.ThreadPoolExecutor(num_jobs) as entry_pool:
+            futures = []
+            for entry_dir in entry_dirs:
+                futures.append(
+                    entry_pool.submit(
+                        Entry.make_icon,
+                        entry_dir=entry_dir,
+                        verbose=verbose,
+                        snapshot=snapshot,
+                        pool=icon_pool,
+                    )
+                )
+            for future in futures:
+                future.result()
+
+
+def update_entry(
+    entry_dir, pool=None, verbose=False, cache_dir=None, snapshot=None
+):
+    """
+    Updates the icon and the optical-character-recognition of one entry.
+
+    Parameters
+    ----------
+    entry_dir : str
+            The entry to be updated.
+    pool : concurrent.futures.Executor (None)
+            When given, the icon is made, and the pages are recognized in
+            this pool. See make_process_pool.
+    cache_dir : str (None)
+            When given, string-archives are taken from, and put into this
+            content-addressed cache. See OcrCache.
+    snapshot : Snapshot.BibliographySnapshot (None)
+            When given, the entry is read from this snapshot.
+    """
+    Entry.make_icon(
+        entry_dir=entry_dir, verbose=verbose, snapshot=snapshot, pool=pool
+    )
+    Entry.update_optical_character_recognition(
+        entry_dir=entry_dir,
+        verbose=verbose,
+        pool=pool,
+        cache_dir=cache_dir,
+        snapshot=snapshot,
+    )
+
+
+def convert_string_archives(
+    entry_dirs, compression=None, num_jobs=1, snapshot=None
+):
+    """
+    Rewrites the string-archives in the 'ocr' of the entries in the current
+    version of the format, see Reader.StringArchive. Archives which already
+    are in this version and compression are not touched.
+    Returns the number of converted string-archives.
+
+    Parameters
+    ----------
+    entry_dirs : list of str
+            The entries to be converted.
+    compression : str (None)
+            'gzip', 'zstd', or None. See Reader.write_string_archive.
+    num_jobs : int (1)
+            Number of processes to convert in.
+    snapshot : Snapshot.BibliographySnapshot (None)
+            When given, the entries are read from this snapshot.
+    """
+    from . import Reader
+
+    paths = []
+    for entry_dir in entry_dirs:
+        paths += Entry.list_ocr_paths(entry_dir, snapshot=snapshot)
+
+    num_converted = 0
+    with make_process_pool(num_jobs) as pool:
+        futures = []
+        for path in paths:
+            futures.append(
+                pool.submit(
+                    Reader.convert_string_archive,
+                    path=path,
+                    compression=compression,
+                )
+            )
+        for path, future in zip(paths, futures):
+            try:
+                if future.result():
+                    num_converted += 1
+            except Exception as err:
+                print(path, err)
+    return num_converted
@@ -1,8 +1,10 @@
 import minimal_bibtex_io
 import os
 import copy
+import json
 import re as regular_expression
 from . import Bibliography
+from . import Snapshot
 
 
 def read_raw(path):
@@ -27,53 +29,281 @@ ENTRY_FMT["author"] = {
 }
 
 
-def make_bib_file(bib_dir, entry_dirs=None, fmt=None, citekey_alias=False):
+BIBTEX_CACHE_FILENAME = "bibtex_cache.json"
+BIBTEX_CACHE_VERSION = 1
+
+
+def get_bibtex_cache_path(bib_dir):
+    bib_dir = os.path.normpath(bib_dir)
+    return os.path.join(
+        bib_dir, Bibliography.HIDDEN_WORK_DIRNAME, BIBTEX_CACHE_FILENAME
+    )
+
+
+def _read_entry_files(bib_path, alias_path):
+    try:
+        bib = read(bib_path)
+        citekeys = []
+        if alias_path is not None:
+            with open(alias_path, "rt") as f:
+                citekeys = f.read().splitlines()
+        return {"bib": bib, "citekey_alias": citekeys, "error": None}
+    except Exception as err:
+        return {"bib": None, "citekey_alias": [], "error": str(err)}
+
+
+def _stat_key(snapshot, path):
+    st = snapshot.stat(path)
+    if st is None:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def read_entry_dirs(bib_dir, entry_dirs=None, num_jobs=1, snapshot=None):
+    """
+    Returns a list with one record for each entry_dir. The record holds
+    the entry's normalized 'reference.bib', the citekeys in its
+    'citekey_alias.txt', and the error when reading failed.
+
+    The records are cached in the hidden work-dir together with the mtimes
+    and sizes of the files they were read from. Only entries with changed
+    files are read again.
+
+    Parameters
+    ----------
+    bib_dir : str
+            The bibliography directory.
+    entry_dirs : list of str (None)
+            The entries to be read. Default is all entries in bib_dir.
+            Only when all entries are read, entries which no longer exist
+            are removed from the cache.
+    num_jobs : int (1)
+            Number of processes to read the changed entries in.
+    snapshot : Snapshot.BibliographySnapshot (None)
+            When given, the mtimes and sizes are taken from this snapshot.
+    """
+    bib_dir = os.path.normpath(bib_dir)
+    if snapshot is None:
+        snapshot = Snapshot.BibliographySnapshot(
+            bib_dir=bib_dir, entry_dirs=entry_dirs
+        )
+    all_entry_dirs = entry_dirs is None
     if entry_dirs is None:
-        entry_dirs = Bibliography.list_entry_dirs(bib_dir)
-
-    out = {
-        "strings": [],
-        "preambles": [],
-        "entries": [],
-    }
-    for entry_dir in entry_dirs:
-        try:
-            bib = read(os.path.join(entry_dir, "reference.bib"))
-            if len(bib["entries"]) > 0:
-                for preamble in bib["preambles"]:
-                    out["preamble"].append(preamble)
-                for string in bib["strings"]:
-                    out["strings"].append(string)
-
-                entry = bib["entries"][0]
-                if fmt:
-                    entry["fields"]["author"] = format_author_field(
-                        author_field=entry["fields"]["author"], **fmt["author"]
-                    )
-                out["entries"].append(entry)
-
-                if citekey_alias:
-                    citekey_alias_path = os.path.join(
-                        entry_dir, "citekey_alias.txt"
-                    )
-                    if os.path.exists(citekey_alias_path):
-                        with open(citekey_alias_path, "rt") as f:
-                            citekeys = f.read().splitlines()
-                        for citekey in citekeys:
-                            if fmt:
-                                entry["fields"]["author"] = (
-                                    format_author_field(
-                                        author_field=entry["fields"]["author"],
-                                        **fmt["author"],
-                                    )
-                                )
-                            alias_entry = copy.copy(entry)
-                            alias_entry["citekey"] = citekey
-                            out["entries"].append(alias_entry)
+        entry_dirs = Bibliography.list_entry_dirs(
+            bib_dir=bib_dir, snapshot=snapshot
+        )
+
+    cache_path = get_bibtex_cache_path(bib_dir)
+    use_cache = os.path.isdir(os.path.dirname(cache_path))
+    old_cache = _read_bibtex_cache(cache_path) if use_cache else {}
+
+    records = [None for entry_dir in entry_dirs]
+    keys = []
+    jobs = []
+    for i, entry_dir in enumerate(entry_dirs):
+        bib_path = os.path.join(entry_dir, "reference.bib")
+        alias_path = os.path.join(entry_dir, "citekey_alias.txt")
+        key = [_stat_key(snapshot, bib_path), _stat_key(snapshot, alias_path)]
+        keys.append(key)
+
+        citekey = os.path.basename(os.path.normpath(entry_dir))
+        if citekey in old_cache and old_cache[citekey]["key"] == key:
+            records[i] = old_cache[citekey]["record"]
+        else:
+            if key[1] is None:
+                alias_path = None
+            jobs.append((i, bib_path, alias_path))
+
+    if num_jobs > 1 and len(jobs) > 1:
+        with Bibliography.make_process_pool(num_jobs) as pool:
+            results = pool.map(
+                _read_entry_files,
+                [job[1] for job in jobs],
+                [job[2] for job in jobs],
+                chunksize=16,
+            )
+            for job, result in zip(jobs, results):
+                records[job[0]] = result
+    else:
+        for job in jobs:
+            records[job[0]] = _read_entry_files(job[1], job[2])
+
+    if use_cache:
+        # When only some entry_dirs were read, the others stay in the cache.
+        new_cache = {} if all_entry_dirs else dict(old_cache)
+        for entry_dir, key, record in zip(entry_dirs, keys, records):
+            citekey = os.path.basename(os.path.normpath(entry_dir))
+            new_cache[citekey] = {"key": key, "record": record}
+        if len(jobs) or set(new_cache) != set(old_cache):
+            _write_bibtex_cache(cache_path, new_cache)
+
+    return records
+
+
+def _read_bibtex_cache(path):
+    try:
+        with open(path, "rt") as f:
+            cache = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if cache.get("version", None) != BIBTEX_CACHE_VERSION:
+        return {}
+    return cache["entries"]
+
+
+def _write_bibtex_cache(path, entries):
+    tmp_path = path + ".part"
+    with open(tmp_path, "wt") as f:
+        f.write(
+            json.dumps({"version": BIBTEX_CACHE_VERSION, "entries": entries})
+        )
+    os.replace(tmp_path, path)
+
+
+def _iter_bib_file_blocks(records, fmt, citekey_alias):
+    """
+    Yields the blocks of the bib-file. The first block holds the preambles
+    and strings of all records. Then each entry, and its aliases, is
+    yielded as soon as its record was processed.
 
+    records must be iterable twice. The first pass only collects the
+    preambles and strings.
+    """
+    preambles = []
+    strings = []
+    for record in records:
+        if record["error"] is not None:
+            continue
+        bib = record["bib"]
+        if len(bib["entries"]) == 0:
+            continue
+        preambles += bib["preambles"]
+        strings += bib["strings"]
+
+    yield minimal_bibtex_io.dumps(
+        {"preambles": preambles, "strings": strings, "entries": []}
+    )
+
+    for record in records:
+        if record["error"] is not None:
+            print(record["error"])
+            continue
+        bib = record["bib"]
+        if len(bib["entries"]) == 0:
+            continue
+        try:
+            entry = copy.deepcopy(bib["entries"][0])
+            if fmt:
+                entry["fields"]["author"] = format_author_field(
+                    author_field=entry["fields"]["author"], **fmt["author"]
+                )
         except Exception as err:
             print(err)
-    return minimal_bibtex_io.dumps(out)
+            continue
+
+        entries = [entry]
+        if citekey_alias:
+            for citekey in record["citekey_alias"]:
+                alias_entry = copy.copy(entry)
+                alias_entry["citekey"] = citekey
+                entries.append(alias_entry)
+        yield minimal_bibtex_io.dumps(
+            {"preambles": [], "strings": [], "entries": entries}
+        )
+
+
+def make_bib_file(
+    bib_dir, entry_dirs=None, fmt=None, citekey_alias=False, num_jobs=1
+):
+    records = read_entry_dirs(
+        bib_dir=bib_dir, entry_dirs=entry_dirs, num_jobs=num_jobs
+    )
+    return str.join(
+        "",
+        _iter_bib_file_blocks(
+            records=records, fmt=fmt, citekey_alias=citekey_alias
+        ),
+    )
+
+
+def write_bib_file(
+    path,
+    bib_dir,
+    entry_dirs=None,
+    fmt=None,
+    citekey_alias=False,
+    num_jobs=1,
+):
+    """
+    Writes the entries of the bibliography into a single bib-file in path.
+    Same as make_bib_file, but the bib-file is written entry by entry into
+    a temporary file which is moved to path when complete.
+    """
+    records = read_entry_dirs(
+        bib_dir=bib_dir, entry_dirs=entry_dirs, num_jobs=num_jobs
+    )
+    path = os.path.normpath(path)
+    tmp_path = os.path.join(
+        os.path.dirname(path), "." + os.path.basename(path) + ".part"
+    )
+    with open(tmp_path, "wt") as f:
+        for block in _iter_bib_file_blocks(
+            records=records, fmt=fmt, citekey_alias=citekey_alias
+        ):
+            f.write(block)
+    os.replace(tmp_path, path)
+
+
+METADATA_FIELD_KEYS = ["title", "author", "year"]
+
+
+class MetadataCache:
+    """
+    Keeps the title, author, and year of entries in memory, e.g. to print
+    search-results. An entry is read again only when its 'reference.bib'
+    changed. Only the 'reference.bib' of the requested entries is read, and
+    nothing is written, so searching does not change the bibliography.
+    """
+
+    def __init__(self, bib_dir):
+        self.bib_dir = os.path.normpath(bib_dir)
+        self._entries = {}
+
+    def _stat_key(self, citekey):
+        try:
+            st = os.stat(os.path.join(self.bib_dir, citekey, "reference.bib"))
+        except FileNotFoundError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    def get(self, citekeys):
+        """
+        Returns a dict citekey -> dict of fields for the citekeys.
+        """
+        keys = {}
+        to_read = []
+        for citekey in citekeys:
+            keys[citekey] = self._stat_key(citekey)
+            if citekey in self._entries:
+                if self._entries[citekey]["key"] == keys[citekey]:
+                    continue
+            if citekey not in to_read:
+                to_read.append(citekey)
+
+        for citekey in to_read:
+            record = _read_entry_files(
+                bib_path=os.path.join(self.bib_dir, citekey, "reference.bib"),
+                alias_path=None,
+            )
+            fields = {}
+            if record["error"] is None and len(record["bib"]["entries"]):
+                all_fields = record["bib"]["entries"][0]["fields"]
+                for key in METADATA_FIELD_KEYS:
+                    if key in all_fields:
+                        fields[key] = all_fields[key]
+            self._entries[citekey] = {"key": keys[citekey], "fields": fields}
+
+        return {c: self._entries[c]["fields"] for c in citekeys}
 
 
 def is_wrapped_in_braces(text):
@@ -0,0 +1,299 @@
+"""
+Finds near-duplicate documents, e.g. the preprint and the published
+version of a paper, or copies of the same original in different entries.
+
+Each string-archive gets a MinHash-signature of the shingles (runs of
+words) in its text. Documents with a high fraction of equal positions in
+their signatures share most of their shingles. Candidates are found with
+locality-sensitive-hashing (LSH) of bands of the signatures, so documents
+are not compared pair by pair.
+"""
+
+import os
+import sys
+import re
+import json
+import zlib
+import base64
+import struct
+from . import Bibliography
+from . import Snapshot
+from . import Entry
+
+SIGNATURE_CACHE_FILENAME = "text_signature_cache.json"
+SIGNATURE_CACHE_VERSION = 1
+
+NUM_BINS = 64
+NUM_BANDS = 16
+SHINGLE_SIZE = 5
+MIN_NUM_SHINGLES = 50
+THRESHOLD = 0.8
+
+_BIN_BITS = 6
+_VALUE_BITS = 32 - _BIN_BITS
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_EMPTY = 0xFFFFFFFF
+_WORD = re.compile(r"\w+")
+
+
+def _hash_shingle(shingle):
+    # crc32 is fast but linear, the multiplication mixes its bits.
+    return (zlib.crc32(shingle.encode()) * 0x9E3779B1) & 0xFFFFFFFF
+
+
+def make_signature(pages, shingle_size=SHINGLE_SIZE):
+    """
+    Returns the MinHash-signature of the text, or None when the text has
+    less than MIN_NUM_SHINGLES shingles.
+
+    This is one-permutation-hashing: Each shingle is hashed once. The hash
+    selects one of NUM_BINS bins and each bin keeps its smallest hash.
+    Empty bins take the value of the next non-empty bin.
+
+    Parameters
+    ----------
+    pages : iterable of str
+            The text, page by page.
+    shingle_size : int
+            Number of words in a shingle.
+    """
+    bins = [_EMPTY for i in range(NUM_BINS)]
+    num_shingles = 0
+    words = []
+    for page in pages:
+        words += _WORD.findall(str.lower(page))
+        for i in range(len(words) - shingle_size + 1):
+            h = _hash_shingle(str.join(" ", words[i : i + shingle_size]))
+            b = h >> _VALUE_BITS
+            v = h & _VALUE_MASK
+            if v < bins[b]:
+                bins[b] = v
+            num_shingles += 1
+        words = words[max([0, len(words) - shingle_size + 1]) :]
+
+    if num_shingles < MIN_NUM_SHINGLES:
+        return None
+
+    # densification
+    for b in range(NUM_BINS):
+        if bins[b] != _EMPTY:
+            continue
+        for distance in range(1, NUM_BINS):
+            other = bins[(b + distance) % NUM_BINS]
+            if other != _EMPTY and other <= _VALUE_MASK:
+                bins[b] = other + (distance << _VALUE_BITS)
+                break
+    return bins
+
+
+def estimate_similarity(signature_a, signature_b):
+    """
+    Returns the estimated Jaccard-similarity of the shingles of two
+    documents.
+    """
+    num_equal = 0
+    for a, b in zip(signature_a, signature_b):
+        if a == b:
+            num_equal += 1
+    return num_equal / len(signature_a)
+
+
+def _encode_signature(signature):
+    if signature is None:
+        return None
+    raw = struct.pack("<{:d}I".format(NUM_BINS), *signature)
+    return base64.b64encode(raw).decode()
+
+
+def _decode_signature(text):
+    if text is None:
+        return None
+    raw = base64.b64decode(text)
+    return list(struct.unpack("<{:d}I".format(NUM_BINS), raw))
+
+
+def get_signature_cache_path(bib_dir):
+    bib_dir = os.path.normpath(bib_dir)
+    return os.path.join(
+        bib_dir, Bibliography.HIDDEN_WORK_DIRNAME, SIGNATURE_CACHE_FILENAME
+    )
+
+
+def _read_signature_cache(path):
+    try:
+        with open(path, "rt") as f:
+            cache = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if cache.get("version", None) != SIGNATURE_CACHE_VERSION:
+        return {}
+    return cache["docs"]
+
+
+def _write_signature_cache(path, docs):
+    tmp_path = path + ".part"
+    with open(tmp_path, "wt") as f:
+        f.write(json.dumps({"version": SIGNATURE_CACHE_VERSION, "docs": docs}))
+    os.replace(tmp_path, path)
+
+
+def read_signatures(bib_dir, snapshot=None):
+    """
+    Returns a dict path -> MinHash-signature for each string-archive in the
+    bibliography. The signature is None for documents with too little text.
+
+    The signatures are cached in the hidden work-dir together with the mtime
+    and size of their string-archive. Only new and changed string-archives
+    are read.
+    """
+    from . import Reader
+
+    bib_dir = os.path.normpath(bib_dir)
+    if snapshot is None:
+        snapshot = Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+
+    cache_path = get_signature_cache_path(bib_dir)
+    use_cache = os.path.isdir(os.path.dirname(cache_path))
+    old_cache = _read_signature_cache(cache_path) if use_cache else {}
+
+    new_cache = {}
+    signatures = {}
+    for entry_dir in Bibliography.list_entry_dirs(
+        bib_dir=bib_dir, snapshot=snapshot
+    ):
+        for path in Entry.list_ocr_paths(entry_dir, snapshot=snapshot):
+            st = snapshot.stat(path)
+            key = [st.st_mtime_ns, st.st_size]
+            relpath = os.path.relpath(path, bib_dir)
+            if relpath in old_cache and old_cache[relpath]["key"] == key:
+                encoded = old_cache[relpath]["signature"]
+            else:
+                try:
+                    with Reader.open_string_archive(path) as arc:
+                        signature = make_signature(
+                            pages=(text for page, text in arc.items())
+                        )
+                except Exception as err:
+                    print(path, err, file=sys.stderr)
+                    continue
+                encoded = _encode_signature(signature)
+            new_cache[relpath] = {"key": key, "signature": encoded}
+            signatures[path] = _decode_signature(encoded)
+
+    if use_cache and new_cache != old_cache:
+        _write_signature_cache(cache_path, new_cache)
+    return signatures
+
+
+def find_clusters(signatures, threshold=THRESHOLD, num_bands=NUM_BANDS):
+    """
+    Returns the clusters of near-duplicate documents in different entries.
+    Each cluster is a sorted list of at least two paths.
+
+    Documents which share a band of their signatures become candidates.
+    Candidates in different entries with an estimated similarity of at
+    least threshold are joined into clusters. Two documents of the same
+    entry are never joined directly, but both may be joined to a document
+    of another entry. The work grows with the number of documents and
+    the number of candidates, but not with the number of pairs.
+    """
+    rows = NUM_BINS // num_bands
+    paths = sorted([p for p in signatures if signatures[p] is not None])
+
+    parent = {path: path for path in paths}
+
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    compared = set()
+    for band in range(num_bands):
+        buckets = {}
+        for path in paths:
+            key = tuple(signatures[path][band * rows : (band + 1) * rows])
+            buckets.setdefault(key, []).append(path)
+        for bucket in buckets.values():
+            for i in range(1, len(bucket)):
+                # Compare with the first and the previous in the bucket.
+                for a in set([bucket[0], bucket[i - 1]]):
+                    b = bucket[i]
+                    if _get_entry_dir(a) == _get_entry_dir(b):
+                        continue
+                    if find(a) == find(b) or (a, b) in compared:
+                        continue
+                    compared.add((a, b))
+                    similarity = estimate_similarity(
+                        signatures[a], signatures[b]
+                    )
+                    if similarity >= threshold:
+                        parent[find(b)] = find(a)
+
+    clusters = {}
+    for path in paths:
+        clusters.setdefault(find(path), []).append(path)
+    return sorted([c for c in clusters.values() if len(c) > 1])
+
+
+def find_duplicates(bib_dir, snapshot=None, threshold=THRESHOLD):
+    """
+    Returns the clusters of near-duplicate string-archives in the
+    bibliography, see find_clusters.
+    """
+    signatures = read_signatures(bib_dir=bib_dir, snapshot=snapshot)
+    return find_clusters(signatures=signatures, threshold=threshold)
+
+
+def map_to_representatives(clusters):
+    """
+    Returns a dict path -> path of the cluster's representative, which is
+    its first path. Only paths in clusters are in the dict. Paths in the
+    same entry as their representative are their own representatives, as
+    only duplicates across entries are collapsed.
+    """
+    out = {}
+    for cluster in clusters:
+        representative_entry_dir = _get_entry_dir(cluster[0])
+        for path in cluster:
+            if _get_entry_dir(path) == representative_entry_dir:
+                out[path] = path
+            else:
+                out[path] = cluster[0]
+    return out
+
+
+def _get_entry_dir(path):
+    return os.path.dirname(os.path.dirname(os.path.normpath(path)))
+
+
+def _split_ocr_path(path):
+    ocr_dir, filename = os.path.split(os.path.normpath(path))
+    entry_dir = os.path.dirname(ocr_dir)
+    return entry_dir, os.path.splitext(filename)[0]
+
+
+def make_warnings(clusters):
+    """
+    Returns a dict entry_dir -> list of W601 warnings about the entry's
+    documents which are near-duplicates of other documents.
+    """
+    warnings = {}
+    for cluster in clusters:
+        for path in cluster:
+            entry_dir, original_filename = _split_ocr_path(path)
+            for other_path in cluster:
+                if _get_entry_dir(other_path) == entry_dir:
+                    continue
+                other_entry_dir, other_original_filename = _split_ocr_path(
+                    other_path
+                )
+                warnings.setdefault(entry_dir, []).append(
+                    "W601:Original '{:s}' is a near-duplicate of "
+                    "'{:s}/{:s}'.".format(
+                        original_filename,
+                        os.path.basename(other_entry_dir),
+                        other_original_filename,
+                    )
+                )
+    return warnings
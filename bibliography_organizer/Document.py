@@ -1,20 +1,44 @@
 import os
 import tempfile
 import subprocess
-import shutil
+from . import Profile
+
+ICON_MIN_SIZE = 128
+ICON_MAX_SIZE = 512
+ICON_SIZE_STEP = 8
+ICON_MIN_QUALITY = 20
+ICON_MAX_QUALITY = 92
 
 
 def extract_icon(document_path, out_path, out_size=100.0e3):
+    """
+    Writes a square jpg-icon of the top of the document's first page to
+    out_path.
+
+    The first page is rendered once. The icon is then encoded in memory.
+    The largest icon-size, and if needed the highest quality, for which the
+    icon is not larger than out_size bytes is found by binary search.
+    """
     out_path = os.path.normpath(out_path)
-    ext = os.path.splitext(out_path)[1]
-    basename = os.path.basename(out_path)
+    with Profile.stage("icon") as record:
+        icon = _make_icon(document_path=document_path, out_size=out_size)
+        tmp_out_path = os.path.join(
+            os.path.dirname(out_path),
+            "." + os.path.basename(out_path) + ".part",
+        )
+        with open(tmp_out_path, "wb") as f:
+            f.write(icon)
+        os.replace(tmp_out_path, out_path)
+        record["bytes"] = len(icon)
+
+
+def _make_icon(document_path, out_size):
+    from PIL import Image
 
     document_path_first_page = document_path + "[0]"
 
     with tempfile.TemporaryDirectory() as tmp_dir:
-        tmp0_out_path = os.path.join(tmp_dir, "0-" + basename + "." + ext)
-        tmp1_out_path = os.path.join(tmp_dir, "1-" + basename + "." + ext)
-
+        tmp_page_path = os.path.join(tmp_dir, "page.png")
         subprocess.call(
             [
                 "convert",
@@ -24,44 +48,364 @@ def extract_icon(document_path, out_path, out_size=100.0e3):
                 "-alpha",
                 "remove",
                 document_path_first_page,
-                tmp0_out_path,
+                tmp_page_path,
             ]
         )
+        with Image.open(tmp_page_path) as page:
+            page = page.convert("RGB")
+
+    sizes = list(range(ICON_MAX_SIZE, ICON_MIN_SIZE - 1, -ICON_SIZE_STEP))
+    icon = _binary_search_largest(
+        candidates=sizes,
+        encode=lambda size: _encode_icon(page, size, ICON_MAX_QUALITY),
+        max_num_bytes=out_size,
+    )
+    if icon is None:
+        qualities = list(range(ICON_MAX_QUALITY, ICON_MIN_QUALITY - 1, -2))
+        icon = _binary_search_largest(
+            candidates=qualities,
+            encode=lambda quality: _encode_icon(page, ICON_MIN_SIZE, quality),
+            max_num_bytes=out_size,
+        )
+    if icon is None:
+        icon = _encode_icon(page, ICON_MIN_SIZE, ICON_MIN_QUALITY)
+    return icon
+
+
+def _encode_icon(page, size, quality):
+    """
+    Returns the jpg-bytes of the page resized to cover a square of size
+    and cropped to this square from the top-center.
+    Like ImageMagick's '-resize SxS^ -gravity north -extent SxS'.
+    """
+    import io
+    from PIL import Image
+
+    scale = size / min(page.size)
+    width = max([size, round(page.size[0] * scale)])
+    height = max([size, round(page.size[1] * scale)])
+    resized = page.resize((width, height), Image.LANCZOS)
+    left = (width - size) // 2
+    square = resized.crop((left, 0, left + size, size))
+
+    buff = io.BytesIO()
+    square.save(buff, format="JPEG", quality=quality)
+    return buff.getvalue()
+
+
+def _binary_search_largest(candidates, encode, max_num_bytes):
+    """
+    Returns the encoding of the first of the candidates which is not larger
+    than max_num_bytes, or None when there is none. The candidates are
+    ordered from the largest to the smallest encoding.
+    """
+    found = None
+    lo = 0
+    hi = len(candidates) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        encoded = encode(candidates[mid])
+        if len(encoded) <= max_num_bytes:
+            found = encoded
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    return found
+
+
+def count_pages(document_path):
+    """
+    Returns the number of pages in the document, or None when ImageMagick
+    can not tell.
+    """
+    process = subprocess.Popen(
+        ["identify", "-ping", "-format", "%n\\n", document_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        return None
+    lines = bytes.split(stdout)
+    if len(lines) == 0:
+        return None
+    try:
+        return int(lines[0])
+    except ValueError:
+        return None
+
+
+def _extract_text_with_pdftotext(document_path):
+    try:
+        process = subprocess.Popen(
+            ["pdftotext", "-layout", "-enc", "UTF-8", document_path, "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        return None
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        return None
+    # pdftotext ends each page with a form-feed.
+    pages = stdout.decode("utf-8", errors="replace").split("\f")
+    return pages[0:-1]
+
 
-        quality = 92
-        min_icon_size = 128
-        icon_size = 512
-        while quality > 20:
-            subprocess.call(
-                [
-                    "convert",
-                    tmp0_out_path,
-                    "-resize",
-                    "{:d}x{:d}^".format(icon_size, icon_size),
-                    "-gravity",
-                    "north",
-                    "-extent",
-                    "{:d}x{:d}".format(icon_size, icon_size),
-                    "-quality",
-                    str(quality),
-                    tmp1_out_path,
-                ]
-            ),
-            actual_size = os.stat(tmp1_out_path).st_size
-            if actual_size <= out_size:
-                break
-            if icon_size > min_icon_size:
-                icon_size -= 8
+TEXT_EXTRACTORS = {"pdftotext": _extract_text_with_pdftotext}
+
+
+def extract_text_layer(document_path, extractor="pdftotext"):
+    """
+    Returns the embedded text of each page in the document, or None when
+    the document has no text-layer which the extractor can read, e.g. when
+    the extractor is not installed.
+    Pages without embedded text, e.g. scans, have empty strings.
+
+    Parameters
+    ----------
+    document_path : str
+            Path to the document.
+    extractor : str ("pdftotext")
+            The name of the extractor in TEXT_EXTRACTORS. An extractor is a
+            function document_path -> list of str, or None.
+    """
+    with Profile.stage("text_layer") as record:
+        pages = TEXT_EXTRACTORS[extractor](document_path)
+        if pages is not None:
+            record["bytes"] = sum([len(page.encode()) for page in pages])
+    if pages is not None and len(pages) == 0:
+        return None
+    return pages
+
+
+def convert_to_images(
+    document_path,
+    out_dir,
+    image_format="jpg",
+    first_page=None,
+    last_page=None,
+    batch=True,
+):
+    """
+    Renders the pages of the document into images in out_dir.
+    The images are named after their page-index, e.g. '000000.jpg'.
+
+    Parameters
+    ----------
+    document_path : str
+            Path to the document.
+    out_dir : str
+            The images are written into this directory.
+    image_format : str ("jpg")
+            The format of the images.
+    first_page : int (None)
+            Index of the first page to be rendered. Default is the first page.
+    last_page : int (None)
+            Index of the last page to be rendered. Default is the last page.
+    batch : bool (True)
+            Render all pages in a single call of ImageMagick. When the number
+            of pages can not be read, or the batch fails, the pages are
+            rendered one by one.
+    """
+    if batch:
+        num_pages = count_pages(document_path=document_path)
+        if num_pages is not None:
+            first = 0 if first_page is None else first_page
+            last = num_pages - 1 if last_page is None else last_page
+            last = min([last, num_pages - 1])
+            if first > last:
+                return
+            return_code = _convert_page_range_to_images(
+                document_path=document_path,
+                out_dir=out_dir,
+                image_format=image_format,
+                first_page=first,
+                last_page=last,
+            )
+            if return_code == 0:
+                return
+
+    _convert_to_images_page_by_page(
+        document_path=document_path,
+        out_dir=out_dir,
+        image_format=image_format,
+        first_page=first_page,
+        last_page=last_page,
+    )
+
+
+def iter_images(
+    document_path, out_dir, image_format="jpg", chunk_size=8, pages=None
+):
+    """
+    Renders the pages of the document chunk by chunk into out_dir and yields
+    the paths of the images in the order of the pages. The next chunk is
+    only rendered when the images of the current chunk were consumed.
+    The consumer may remove an image once it was yielded.
+
+    Parameters
+    ----------
+    document_path : str
+            Path to the document.
+    out_dir : str
+            The images are written into this directory.
+    image_format : str ("jpg")
+            The format of the images.
+    chunk_size : int (8)
+            Number of pages rendered in a single call of ImageMagick.
+    pages : list of int (None)
+            The indices of the pages to be rendered. Default is all pages.
+    """
+    if pages is not None:
+        for first_page, last_page in _group_pages(pages, chunk_size):
+            with Profile.stage("render") as record:
+                image_paths = _convert_page_range_to_existing_images(
+                    document_path=document_path,
+                    out_dir=out_dir,
+                    image_format=image_format,
+                    first_page=first_page,
+                    last_page=last_page,
+                )
+                record["bytes"] = sum(
+                    [os.path.getsize(path) for path in image_paths]
+                )
+            for image_path in image_paths:
+                yield image_path
+        return
+
+    num_pages = count_pages(document_path=document_path)
+    first_page = 0
+    while num_pages is None or first_page < num_pages:
+        with Profile.stage("render") as record:
+            last_page = first_page + chunk_size - 1
+            if num_pages is None:
+                _convert_to_images_page_by_page(
+                    document_path=document_path,
+                    out_dir=out_dir,
+                    image_format=image_format,
+                    first_page=first_page,
+                    last_page=last_page,
+                )
             else:
-                quality -= 2
+                last_page = min([last_page, num_pages - 1])
+                return_code = _convert_page_range_to_images(
+                    document_path=document_path,
+                    out_dir=out_dir,
+                    image_format=image_format,
+                    first_page=first_page,
+                    last_page=last_page,
+                )
+                if return_code != 0:
+                    _convert_to_images_page_by_page(
+                        document_path=document_path,
+                        out_dir=out_dir,
+                        image_format=image_format,
+                        first_page=first_page,
+                        last_page=last_page,
+                    )
+
+            image_paths = []
+            num_bytes = 0
+            for pagenumber in range(first_page, last_page + 1):
+                image_path = os.path.join(
+                    out_dir, "{:06d}.".format(pagenumber) + image_format
+                )
+                if os.path.exists(image_path):
+                    image_paths.append(image_path)
+                    num_bytes += os.path.getsize(image_path)
+            record["bytes"] = num_bytes
+
+        for image_path in image_paths:
+            yield image_path
+
+        if num_pages is None and len(image_paths) < chunk_size:
+            break
+        first_page = last_page + 1
+
+
+def _group_pages(pages, chunk_size):
+    """
+    Returns the (first_page, last_page) of each range of consecutive pages.
+    No range has more than chunk_size pages.
+    """
+    ranges = []
+    for page in sorted(set(pages)):
+        if (
+            len(ranges)
+            and ranges[-1][1] == page - 1
+            and page - ranges[-1][0] < chunk_size
+        ):
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return [tuple(r) for r in ranges]
+
+
+def _convert_page_range_to_existing_images(
+    document_path, out_dir, image_format, first_page, last_page
+):
+    return_code = _convert_page_range_to_images(
+        document_path=document_path,
+        out_dir=out_dir,
+        image_format=image_format,
+        first_page=first_page,
+        last_page=last_page,
+    )
+    if return_code != 0:
+        _convert_to_images_page_by_page(
+            document_path=document_path,
+            out_dir=out_dir,
+            image_format=image_format,
+            first_page=first_page,
+            last_page=last_page,
+        )
+    image_paths = []
+    for pagenumber in range(first_page, last_page + 1):
+        image_path = os.path.join(
+            out_dir, "{:06d}.".format(pagenumber) + image_format
+        )
+        if os.path.exists(image_path):
+            image_paths.append(image_path)
+    return image_paths
+
 
-        shutil.move(src=tmp1_out_path, dst=out_path)
+def _convert_page_range_to_images(
+    document_path, out_dir, image_format, first_page, last_page
+):
+    process = subprocess.Popen(
+        [
+            "convert",
+            "-density",
+            "200",
+            "-alpha",
+            "remove",
+            "-quality",
+            "92",
+            document_path + "[{:d}-{:d}]".format(first_page, last_page),
+            "-scene",
+            str(first_page),
+            os.path.join(out_dir, "%06d." + image_format),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = process.communicate()
+    if stderr:
+        print(stderr)
+    if stdout:
+        print(stdout)
+    return process.returncode
 
 
-def convert_to_images(document_path, out_dir, image_format="jpg"):
-    pagenumber = 0
+def _convert_to_images_page_by_page(
+    document_path, out_dir, image_format, first_page=None, last_page=None
+):
+    pagenumber = 0 if first_page is None else first_page
     return_code = 0
     while return_code == 0:
+        if last_page is not None and pagenumber > last_page:
+            break
         process = subprocess.Popen(
             [
                 "convert",
@@ -1,26 +1,34 @@
 import os
-import glob
+import html
 import textwrap
+import re as regular_expression
 import shutil
 from . import Document
 from . import Reader
 from . import Status
 from . import Bibtex
+from . import OcrCache
+from . import OcrCheckpoint
+from . import Snapshot
+from . import Profile
 
 
-def list_original_paths(entry_dir):
+def list_original_paths(entry_dir, snapshot=None):
     """
     Returns a list of original documnet paths.
     Document-file-names equal to the citekey go first in the list.
     """
     entry_dir = os.path.normpath(entry_dir)
+    if snapshot is None:
+        snapshot = Snapshot.make_entry_snapshot(entry_dir)
     citekey = os.path.basename(entry_dir)
-    original_paths = glob.glob(os.path.join(entry_dir, "original", "*"))
-    primary_paths = glob.glob(
-        os.path.join(entry_dir, "original", citekey + "*")
-    )
-    original_paths.sort()
-    primary_paths.sort()
+    original_dir = os.path.join(entry_dir, "original")
+    original_paths = []
+    primary_paths = []
+    for filename in snapshot.listdir(original_dir):
+        original_paths.append(os.path.join(original_dir, filename))
+        if str.startswith(filename, citekey):
+            primary_paths.append(os.path.join(original_dir, filename))
     out = []
     for prim in primary_paths:
         out.append(prim)
@@ -35,32 +43,56 @@ def vprint(verbose, *args):
         print(*args)
 
 
-def make_icon(entry_dir, verbose=False):
+def make_icon(entry_dir, verbose=False, snapshot=None, pool=None):
+    """
+    Makes the 'icon.jpg' of the entry from its primary original unless
+    there is one already.
+
+    Parameters
+    ----------
+    pool : concurrent.futures.Executor (None)
+            When given, the icon is made in this pool.
+    """
     entry_dir = os.path.normpath(entry_dir)
+    if snapshot is None:
+        snapshot = Snapshot.make_entry_snapshot(entry_dir)
     citekey = os.path.basename(entry_dir)
-    original_paths = list_original_paths(entry_dir)
+    original_paths = list_original_paths(entry_dir, snapshot=snapshot)
 
     if len(original_paths) > 0:
         icon_path = os.path.join(entry_dir, "icon.jpg")
-        if not os.path.exists(icon_path):
+        if not snapshot.exists(icon_path):
             print(citekey, ", Create icon.")
-            Document.extract_icon(
-                document_path=original_paths[0],
-                out_path=icon_path,
-                out_size=100.0e3,
-            )
+            with Profile.labels(entry=citekey):
+                if pool is None:
+                    Document.extract_icon(
+                        document_path=original_paths[0],
+                        out_path=icon_path,
+                        out_size=100.0e3,
+                    )
+                else:
+                    Profile.submit(
+                        pool,
+                        Document.extract_icon,
+                        document_path=original_paths[0],
+                        out_path=icon_path,
+                        out_size=100.0e3,
+                    ).result()
         else:
             vprint(verbose, citekey, ", Skip. Already done.")
     else:
         vprint(verbose, citekey, ", No originals.")
 
 
-def list_ocr_paths(entry_dir):
+def list_ocr_paths(entry_dir, snapshot=None):
     entry_dir = os.path.normpath(entry_dir)
+    if snapshot is None:
+        snapshot = Snapshot.make_entry_snapshot(entry_dir)
     arcs = []
-    orc_wildcard = os.path.join(entry_dir, "ocr", "*.tar")
-    for archive_path in glob.glob(orc_wildcard):
-        arcs.append(archive_path)
+    ocr_dir = os.path.join(entry_dir, "ocr")
+    for filename in snapshot.listdir(ocr_dir):
+        if str.endswith(filename, ".tar"):
+            arcs.append(os.path.join(ocr_dir, filename))
     return arcs
 
 
@@ -74,13 +106,29 @@ def hide_file_in_its_directory(path):
     )
 
 
-def update_optical_character_recognition(entry_dir, verbose=False):
+def update_optical_character_recognition(
+    entry_dir,
+    verbose=False,
+    pool=None,
+    cache_dir=None,
+    max_cache_size=OcrCache.MAX_CACHE_SIZE,
+    snapshot=None,
+):
     entry_dir = os.path.normpath(entry_dir)
+    if snapshot is None:
+        snapshot = Snapshot.make_entry_snapshot(entry_dir)
     citekey = os.path.basename(entry_dir)
     os.makedirs(os.path.join(entry_dir, "ocr"), exist_ok=True)
 
-    original_paths = list_original_paths(entry_dir)
-    ocr_paths = list_ocr_paths(entry_dir)
+    original_paths = list_original_paths(entry_dir, snapshot=snapshot)
+    ocr_paths = list_ocr_paths(entry_dir, snapshot=snapshot)
+
+    # Checkpoints are kept when the entry is in an initialized bib_dir.
+    checkpoint_root = OcrCheckpoint.get_checkpoint_root(
+        os.path.dirname(entry_dir)
+    )
+    if not os.path.isdir(os.path.dirname(checkpoint_root)):
+        checkpoint_root = None
 
     for ocr_path in ocr_paths:
         ocr_original_filename = os.path.splitext(os.path.basename(ocr_path))[0]
@@ -88,7 +136,7 @@ def update_optical_character_recognition(entry_dir, verbose=False):
             entry_dir, "original", ocr_original_filename
         )
 
-        if not os.path.exists(ocr_original_path):
+        if not snapshot.exists(ocr_original_path):
             vprint(
                 verbose,
                 "{:s} : No original for OCR {:s}. Ignore OCR.".format(
@@ -110,22 +158,105 @@ def update_optical_character_recognition(entry_dir, verbose=False):
                 ),
             )
             try:
-                Reader.document_to_string_archive(
-                    document_path=original_path,
-                    out_path=orig_ocr_path,
+                _update_optical_character_recognition_of_original(
+                    citekey=citekey,
+                    original_path=original_path,
+                    ocr_path=orig_ocr_path,
+                    verbose=verbose,
+                    pool=pool,
+                    cache_dir=cache_dir,
+                    max_cache_size=max_cache_size,
+                    checkpoint_root=checkpoint_root,
                 )
             except Exception as err:
                 print(err)
 
 
-def print_status(entry_dir):
+def _update_optical_character_recognition_of_original(
+    citekey,
+    original_path,
+    ocr_path,
+    verbose,
+    pool,
+    cache_dir,
+    max_cache_size,
+    checkpoint_root=None,
+):
+    original_filename = os.path.basename(original_path)
+    with Profile.labels(entry=citekey, document=original_filename):
+        content_hash = None
+        if (
+            cache_dir is not None or checkpoint_root is not None
+        ) and os.path.isfile(original_path):
+            content_hash = OcrCache.hash_file(original_path)
+        if cache_dir is not None and content_hash is not None:
+            if OcrCache.get(
+                cache_dir=cache_dir,
+                content_hash=content_hash,
+                out_path=ocr_path,
+            ):
+                vprint(
+                    verbose,
+                    "{:s} : Take OCR of {:s} from cache.".format(
+                        citekey, original_filename
+                    ),
+                )
+                return
+
+        checkpoint_dir = None
+        if checkpoint_root is not None and content_hash is not None:
+            OcrCheckpoint.evict(checkpoint_root)
+            checkpoint_dir = OcrCheckpoint.get_checkpoint_dir(
+                checkpoint_root, content_hash
+            )
+            if os.path.isdir(checkpoint_dir):
+                vprint(
+                    verbose,
+                    "{:s} : Resume OCR of {:s} from checkpoint.".format(
+                        citekey, original_filename
+                    ),
+                )
+
+        Reader.document_to_string_archive(
+            document_path=original_path,
+            out_path=ocr_path,
+            pool=pool,
+            checkpoint_dir=checkpoint_dir,
+        )
+
+        if cache_dir is not None and content_hash is not None:
+            OcrCache.put(
+                cache_dir=cache_dir,
+                content_hash=content_hash,
+                path=ocr_path,
+                max_cache_size=max_cache_size,
+            )
+
+
+def print_status(entry_dir, snapshot=None, errors=None):
     entry_dir = os.path.normpath(entry_dir)
-    errors = Status.list_errors_in_entry(entry_dir=entry_dir)
-    citekey = os.path.basename(entry_dir)
-    for msg in errors:
-        err_code_str = msg[0:4]
-        err_msg = msg[5:]
-        print("{:40s} {:s} {:s}".format(citekey, err_code_str, err_msg))
+    if errors is None:
+        errors = Status.list_errors_in_entry(
+            entry_dir=entry_dir, snapshot=snapshot
+        )
+    for record in make_status_records(entry_dir, errors=errors):
+        print(
+            "{:40s} {:s} {:s}".format(
+                record["citekey"], record["code"], record["message"]
+            )
+        )
+
+
+def make_status_records(entry_dir, errors):
+    """
+    Returns a list of dicts with the 'citekey', the 'code', e.g. 'E201',
+    and the 'message' of each of the entry's errors.
+    """
+    citekey = os.path.basename(os.path.normpath(entry_dir))
+    return [
+        {"citekey": citekey, "code": msg[0:4], "message": msg[5:]}
+        for msg in errors
+    ]
 
 
 def _print_field(field, width, indent, num_lines=-1):
@@ -138,29 +269,57 @@ def _print_field(field, width, indent, num_lines=-1):
     return out
 
 
+def _highlight_to_text(highlight):
+    """
+    Returns the highlight of a search-result, see Index.Search.search, as
+    plain text with the matching terms in upper case.
+    """
+    text = regular_expression.sub(
+        r"<b [^>]*>(.*?)</b>",
+        lambda match: str.upper(match.group(1)),
+        highlight,
+    )
+    return html.unescape(text)
+
+
 def print_overview(
-    entry_dir, width=79, indent=4, original_filename=None, num_filed_lines=1
+    entry_dir,
+    width=79,
+    indent=4,
+    original_filename=None,
+    num_filed_lines=1,
+    page=None,
+    fields=None,
+    highlight=None,
 ):
     citekey = os.path.basename(entry_dir)
 
     out = citekey
     if original_filename:
         out += " : " + original_filename
+    if page:
+        out += ", page {:d}".format(page)
     out += "\n"
     out += "-" * len(citekey) + "\n"
 
-    bib_file_path = os.path.join(entry_dir, "reference.bib")
-    if os.path.exists(bib_file_path):
-        bib = Bibtex.read(path=bib_file_path)
-        bib_entry = bib["entries"][0]
-        fields = bib_entry["fields"]
-
-        for key in ["title", "author", "year"]:
-            if key in fields:
-                out += _print_field(
-                    fields[key],
-                    width=width,
-                    indent=indent,
-                    num_lines=num_filed_lines,
-                )
+    if fields is None:
+        bib_file_path = os.path.join(entry_dir, "reference.bib")
+        if os.path.exists(bib_file_path):
+            bib = Bibtex.read(path=bib_file_path)
+            fields = bib["entries"][0]["fields"]
+        else:
+            fields = {}
+
+    for key in Bibtex.METADATA_FIELD_KEYS:
+        if key in fields:
+            out += _print_field(
+                str(fields[key]),
+                width=width,
+                indent=indent,
+                num_lines=num_filed_lines,
+            )
+    if highlight:
+        out += "\n" + _print_field(
+            _highlight_to_text(highlight), width=width, indent=indent
+        )
     print(out)
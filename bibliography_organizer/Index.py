@@ -4,105 +4,619 @@ import whoosh.index
 import whoosh.query
 import whoosh.qparser
 import os
-import glob
+import sys
+import json
+import shutil
+import re as regular_expression
 from . import Reader
 from . import Bibliography
+from . import Entry
+from . import Snapshot
+from . import Bibtex
+from . import OcrCache
+from . import Profile
+from . import Dedup
 
 INDEX_DIRNAME = "full_text_search_index"
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+MAX_CONTENT_SIZE = 2**26
 
 
-def get_schema():
-    return whoosh.fields.Schema(
-        path=whoosh.fields.ID(unique=True, stored=True),
-        content=whoosh.fields.TEXT(stored=True),
-        modtime=whoosh.fields.STORED,
-    )
+def get_schema(per_page=False, store_content=True):
+    """
+    Returns the schema of the search-index.
+
+    Besides the text, each document holds the fields title, author, year,
+    journal, and keywords from the entry's 'reference.bib', and the
+    citekey together with the aliases in 'citekey_alias.txt'. These can be
+    queried e.g. with 'author:darwin' or 'year:[2010 TO 2020]'.
+
+    Parameters
+    ----------
+    per_page : bool (False)
+            If False, there is one document in the index for each
+            string-archive. If True, there is one document for each page
+            in each string-archive. The page-documents store the citekey,
+            the original, and the page-number.
+    store_content : bool (True)
+            If False, the text is indexed but not stored in the index.
+            Highlights are then made from the string-archives when needed.
+    """
+    fields = {
+        "path": whoosh.fields.ID(unique=not per_page, stored=True),
+        "content": whoosh.fields.TEXT(stored=store_content),
+        "modtime": whoosh.fields.STORED,
+        "citekey": whoosh.fields.KEYWORD(
+            stored=per_page, commas=True, scorable=True
+        ),
+        "title": whoosh.fields.TEXT,
+        "author": whoosh.fields.TEXT,
+        "year": whoosh.fields.NUMERIC,
+        "journal": whoosh.fields.TEXT,
+        "keywords": whoosh.fields.KEYWORD(
+            commas=True, lowercase=True, scorable=True
+        ),
+    }
+    if per_page:
+        fields["original"] = whoosh.fields.ID(stored=True)
+        fields["page"] = whoosh.fields.NUMERIC(stored=True)
+    return whoosh.fields.Schema(**fields)
+
+
+def is_per_page(schema):
+    return "page" in schema
+
+
+def is_content_stored(schema):
+    return schema["content"].stored
 
 
-def list_all_docs_in_bibliography(bib_dir):
+def _join_pages(pages, max_content_size=None):
+    """
+    Returns the text of the pages, each followed by an empty line, and the
+    number of pages in the text. The text is joined once, so its size is
+    copied only once.
+
+    Parameters
+    ----------
+    pages : iterable of str
+            The text of the pages, in order.
+    max_content_size : int (None)
+            Pages after the first max_content_size characters are left out.
+    """
+    parts = []
+    size = 0
+    num_pages = 0
+    for page in pages:
+        if (
+            max_content_size is not None
+            and size + len(page) > max_content_size
+        ):
+            break
+        parts.append(page)
+        parts.append("\n\n")
+        size += len(page) + 2
+        num_pages += 1
+    return str.join("", parts), num_pages
+
+
+def _iter_pages(arc):
+    for pagenumber, page in arc.items():
+        yield page
+
+
+def list_all_docs_in_bibliography(bib_dir, snapshot=None):
     bib_dir = os.path.normpath(bib_dir)
-    entry_dirs = Bibliography.list_entry_dirs(bib_dir=bib_dir)
+    if snapshot is None:
+        snapshot = Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+    entry_dirs = Bibliography.list_entry_dirs(
+        bib_dir=bib_dir, snapshot=snapshot
+    )
 
     docs = []
     for entry_dir in entry_dirs:
-        orc_wildcard = os.path.join(entry_dir, "ocr", "*.tar")
-        for string_archive_path in glob.glob(orc_wildcard):
-            docs.append(string_archive_path)
+        docs += Entry.list_ocr_paths(entry_dir, snapshot=snapshot)
     return docs
 
 
-def add_doc(index_writer, path):
+INDEXED_BIBTEX_FIELD_KEYS = ["title", "author", "journal", "keywords"]
+
+
+def make_metadata(citekey, record):
+    """
+    Returns the fields for the search-index from the entry's record of
+    Bibtex.read_entry_dirs.
+    """
+    metadata = {}
+    metadata["citekey"] = str.join(
+        ",", [citekey] + record.get("citekey_alias", [])
+    )
+    if record.get("error", None) is not None:
+        return metadata
+    if len(record["bib"]["entries"]) == 0:
+        return metadata
+
+    fields = record["bib"]["entries"][0]["fields"]
+    for key in INDEXED_BIBTEX_FIELD_KEYS:
+        if key in fields:
+            metadata[key] = str(fields[key])
+    if "year" in fields:
+        match = regular_expression.search(r"\d{4}", str(fields["year"]))
+        if match:
+            metadata["year"] = int(match.group(0))
+    return metadata
+
+
+def read_metadata(bib_dir, snapshot=None, entry_dirs=None):
+    """
+    Returns a dict citekey -> fields for the search-index, see make_metadata.
+    """
+    records = Bibtex.read_entry_dirs(
+        bib_dir=bib_dir, entry_dirs=entry_dirs, snapshot=snapshot
+    )
+    if entry_dirs is None:
+        entry_dirs = Bibliography.list_entry_dirs(
+            bib_dir=bib_dir, snapshot=snapshot
+        )
+    out = {}
+    for entry_dir, record in zip(entry_dirs, records):
+        citekey = os.path.basename(os.path.normpath(entry_dir))
+        out[citekey] = make_metadata(citekey=citekey, record=record)
+    return out
+
+
+def get_doc_modtime(path, snapshot):
+    """
+    Returns the modification-time of the document in the search-index.
+    This is the latest mtime of the string-archive, and of the entry's
+    'reference.bib' and 'citekey_alias.txt'.
+    """
+    path = os.path.normpath(path)
+    entry_dir = os.path.dirname(os.path.dirname(path))
+    modtime = snapshot.getmtime(path)
+    for filename in ["reference.bib", "citekey_alias.txt"]:
+        st = snapshot.stat(os.path.join(entry_dir, filename))
+        if st is not None:
+            modtime = max([modtime, st.st_mtime])
+    return modtime
+
+
+def add_doc(
+    index_writer,
+    path,
+    metadata=None,
+    modtime=None,
+    max_content_size=MAX_CONTENT_SIZE,
+):
+    """
+    Adds the string-archive in path to the index.
+
+    The pages are read one by one from the string-archive. When the index
+    is per page, only one page is in memory at a time. Otherwise the text
+    of a document is limited to max_content_size characters. The pages
+    after this limit are not indexed.
+    """
     path = os.path.normpath(path)
     citekey, original_filename = _split_path(path)
     print(citekey, "Add to index", original_filename)
+    with Profile.stage(
+        "index_add", entry=citekey, document=original_filename
+    ) as record:
+        with Reader.open_string_archive(path=path) as arc:
+            _add_doc(
+                index_writer=index_writer,
+                path=path,
+                arc=arc,
+                metadata=metadata,
+                modtime=modtime,
+                max_content_size=max_content_size,
+            )
+        record["bytes"] = os.path.getsize(path)
+
 
+def _add_doc(index_writer, path, arc, metadata, modtime, max_content_size):
+    citekey, original_filename = _split_path(path)
     assert os.path.splitext(path)[1] == ".tar"
-    arc = Reader.read_string_archive(path=path)
-
-    content = ""
-    for pagenumber in arc:
-        content += arc[pagenumber] + "\n\n"
-    index_writer.add_document(
-        content=content,
-        path=os.path.join(citekey, "ocr", original_filename + ".tar"),
-        modtime=os.path.getmtime(path),
+    indexed_path = os.path.join(citekey, "ocr", original_filename + ".tar")
+    if modtime is None:
+        modtime = os.path.getmtime(path)
+
+    doc = {"path": indexed_path, "modtime": modtime}
+    if metadata is not None:
+        for key in metadata:
+            if key in index_writer.schema:
+                doc[key] = metadata[key]
+
+    if is_per_page(index_writer.schema):
+        for pagenumber, page in arc.items():
+            page_doc = dict(doc)
+            page_doc["content"] = page
+            page_doc["original"] = original_filename
+            page_doc["page"] = pagenumber
+            if "citekey" not in page_doc:
+                page_doc["citekey"] = citekey
+            index_writer.add_document(**page_doc)
+        return
+
+    doc["content"], num_pages = _join_pages(
+        pages=_iter_pages(arc), max_content_size=max_content_size
     )
+    if num_pages < len(arc):
+        print(
+            citekey,
+            original_filename,
+            "Only the first {:d} of {:d} pages are indexed.".format(
+                num_pages, len(arc)
+            ),
+            "Use the index per page for larger documents.",
+        )
+    index_writer.add_document(**doc)
+
+
+def open_writer(index, num_procs=1, limitmb=128):
+    """
+    Returns a writer for the index.
+
+    Parameters
+    ----------
+    num_procs : int (1)
+            When larger one, the documents are indexed in this many processes.
+            Each process writes its own segment into the index.
+    limitmb : int (128)
+            Max. memory in MB used by each process to buffer postings.
+    """
+    if num_procs > 1:
+        return index.writer(
+            procs=num_procs, limitmb=limitmb, multisegment=True
+        )
+    else:
+        return index.writer(limitmb=limitmb)
+
+
+def get_manifest_path(index_dir):
+    return os.path.join(index_dir, MANIFEST_FILENAME)
+
+
+def read_manifest(index_dir):
+    """
+    Returns the manifest of the index, a dict indexed_path -> record, or
+    None when the index has no (valid) manifest.
+    """
+    try:
+        with open(get_manifest_path(index_dir), "rt") as f:
+            manifest = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("version", None) != MANIFEST_VERSION:
+        return None
+    return manifest["docs"]
 
 
-def make_clean_index(bib_dir):
+def read_collapse_duplicates(index_dir):
+    """
+    Returns True when the index only has one document of each cluster of
+    near-duplicates, see Dedup.
+    """
+    try:
+        with open(get_manifest_path(index_dir), "rt") as f:
+            manifest = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return False
+    return bool(manifest.get("collapse_duplicates", False))
+
+
+def write_manifest(index_dir, docs, collapse_duplicates=False):
+    path = get_manifest_path(index_dir)
+    tmp_path = os.path.join(index_dir, "." + MANIFEST_FILENAME + ".part")
+    with open(tmp_path, "wt") as f:
+        f.write(
+            json.dumps(
+                {
+                    "version": MANIFEST_VERSION,
+                    "collapse_duplicates": collapse_duplicates,
+                    "docs": docs,
+                }
+            )
+        )
+    os.replace(tmp_path, path)
+
+
+def _remove_duplicates(bib_dir, paths, snapshot=None):
+    """
+    Returns the dict indexed_path -> path without the near-duplicates of
+    other documents. Only the representative of each cluster of
+    near-duplicates is kept, see Dedup.
+    """
+    representatives = Dedup.map_to_representatives(
+        Dedup.find_duplicates(bib_dir=bib_dir, snapshot=snapshot)
+    )
+    out = {}
+    for indexed_path, path in paths.items():
+        if representatives.get(path, path) == path:
+            out[indexed_path] = path
+    return out
+
+
+def _get_metadata_mtime_ns(entry_dir, snapshot):
+    mtime_ns = 0
+    for filename in ["reference.bib", "citekey_alias.txt"]:
+        st = snapshot.stat(os.path.join(entry_dir, filename))
+        if st is not None:
+            mtime_ns = max([mtime_ns, st.st_mtime_ns])
+    return mtime_ns
+
+
+def make_manifest_record(path, snapshot, sha256=None):
+    """
+    Returns the record of the document in the manifest of the index:
+    The mtime and size of the string-archive, its sha256, and the latest
+    mtime of the entry's 'reference.bib' and 'citekey_alias.txt'.
+    """
+    path = os.path.normpath(path)
+    entry_dir = os.path.dirname(os.path.dirname(path))
+    st = snapshot.stat(path)
+    if sha256 is None:
+        sha256 = OcrCache.hash_file(path)
+    return {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "sha256": sha256,
+        "metadata_mtime_ns": _get_metadata_mtime_ns(entry_dir, snapshot),
+    }
+
+
+def _read_manifest_from_stored_fields(index, bib_dir, snapshot):
+    """
+    Returns a manifest for an index which was created without one.
+    This loads all stored fields once. Documents changed since they were
+    indexed get no record and are reindexed.
+    """
+    docs = {}
+    with index.searcher() as searcher:
+        for fields in searcher.all_stored_fields():
+            indexed_path = fields["path"]
+            if indexed_path in docs:
+                # The other pages of a string-archive
+                continue
+            path = os.path.join(bib_dir, indexed_path)
+            record = None
+            if snapshot.exists(path):
+                mtime = get_doc_modtime(path=path, snapshot=snapshot)
+                if mtime <= fields["modtime"]:
+                    record = make_manifest_record(path, snapshot)
+            docs[indexed_path] = record
+    return docs
+
+
+def _is_unchanged(record, path, snapshot):
+    """
+    Returns True when the document at path is the one in the manifest's
+    record. Only when mtime or size of the string-archive changed, its
+    sha256 is compared. A record with a matching sha256 is updated in place.
+    """
+    if record is None:
+        return False
+    entry_dir = os.path.dirname(os.path.dirname(path))
+    metadata_mtime_ns = _get_metadata_mtime_ns(entry_dir, snapshot)
+    if metadata_mtime_ns != record["metadata_mtime_ns"]:
+        return False
+    st = snapshot.stat(path)
+    if st.st_mtime_ns == record["mtime_ns"] and st.st_size == record["size"]:
+        return True
+    if st.st_size != record["size"]:
+        return False
+    sha256 = OcrCache.hash_file(path)
+    if sha256 != record["sha256"]:
+        return False
+    record["mtime_ns"] = st.st_mtime_ns
+    return True
+
+
+def make_clean_index(
+    bib_dir,
+    snapshot=None,
+    num_procs=1,
+    limitmb=128,
+    index_dir=None,
+    per_page=False,
+    store_content=True,
+    collapse_duplicates=False,
+):
     # Create the index from scratch
-    index = whoosh.index.create_in(get_index_dir(bib_dir), schema=get_schema())
-    index_writer = index.writer()
-    for doc_path in list_all_docs_in_bibliography(bib_dir=bib_dir):
-        add_doc(index_writer=index_writer, path=doc_path)
+    if index_dir is None:
+        index_dir = get_index_dir(bib_dir)
+    index = whoosh.index.create_in(
+        index_dir,
+        schema=get_schema(per_page=per_page, store_content=store_content),
+    )
+    index_writer = open_writer(
+        index=index, num_procs=num_procs, limitmb=limitmb
+    )
+    if snapshot is None:
+        snapshot = Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+    metadata = read_metadata(bib_dir=bib_dir, snapshot=snapshot)
+    doc_paths = list_all_docs_in_bibliography(
+        bib_dir=bib_dir, snapshot=snapshot
+    )
+    if collapse_duplicates:
+        doc_paths = list(
+            _remove_duplicates(
+                bib_dir=bib_dir,
+                paths={p: p for p in doc_paths},
+                snapshot=snapshot,
+            ).values()
+        )
+    manifest = {}
+    for doc_path in doc_paths:
+        citekey, original_filename = _split_path(doc_path)
+        add_doc(
+            index_writer=index_writer,
+            path=doc_path,
+            metadata=metadata.get(citekey, None),
+            modtime=get_doc_modtime(path=doc_path, snapshot=snapshot),
+        )
+        indexed_path = os.path.join(citekey, "ocr", original_filename + ".tar")
+        manifest[indexed_path] = make_manifest_record(doc_path, snapshot)
     print("Commit changes to index.")
-    index_writer.commit()
+    with Profile.stage("index_commit"):
+        index_writer.commit()
+    write_manifest(
+        index_dir, manifest, collapse_duplicates=collapse_duplicates
+    )
 
 
-def increment_index(bib_dir):
+def increment_index(
+    bib_dir, snapshot=None, num_procs=1, limitmb=128, entry_dirs=None
+):
+    """
+    Updates the index with the string-archives which were added, changed,
+    or deleted since the last update.
+
+    The documents in the index are listed in the index's manifest. The
+    manifest is compared against one walk over the bibliography, so neither
+    the index itself nor unchanged string-archives are read. The index is
+    only opened for writing when something changed.
+
+    Parameters
+    ----------
+    entry_dirs : list of str (None)
+            When given, only the documents of these entries are updated.
+            Entries which do not exist anymore are deleted from the index.
+            Default is to update all entries in bib_dir.
+
+    When the index collapses near-duplicates, see migrate_index, only the
+    representative of each cluster of near-duplicates is indexed.
+    """
     bib_dir = os.path.normpath(bib_dir)
-    index = whoosh.index.open_dir(get_index_dir(bib_dir))
+    partial = entry_dirs is not None
+    if snapshot is None:
+        snapshot = Snapshot.BibliographySnapshot(
+            bib_dir=bib_dir, entry_dirs=entry_dirs
+        )
+    index_dir = get_index_dir(bib_dir)
+    index = whoosh.index.open_dir(index_dir)
 
-    # The set of all paths in the index
-    indexed_paths = set()
-    # The set of all paths we need to re-index
-    to_index = set()
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        if entry_dirs is not None:
+            # The manifest is made for all entries.
+            snapshot = Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+        manifest = _read_manifest_from_stored_fields(
+            index=index, bib_dir=bib_dir, snapshot=snapshot
+        )
+        manifest_changed = True
+    else:
+        manifest_changed = False
+    collapse_duplicates = read_collapse_duplicates(index_dir)
 
-    with index.searcher() as searcher:
-        index_writer = index.writer()
+    if entry_dirs is None:
+        entry_dirs = Bibliography.list_entry_dirs(
+            bib_dir=bib_dir, snapshot=snapshot
+        )
+        citekeys = None
+    else:
+        entry_dirs = [os.path.normpath(e) for e in entry_dirs]
+        citekeys = set([os.path.basename(e) for e in entry_dirs])
 
-        for fields in searcher.all_stored_fields():
-            indexed_path = fields["path"]
-            citekey, original_filename = _split_path(indexed_path)
-            indexed_paths.add(os.path.join(bib_dir, indexed_path))
-
-            if not os.path.exists(indexed_path):
-                index_writer.delete_by_term("path", indexed_path)
-                print(
-                    citekey,
-                    original_filename,
-                    "Delete from Index.",
-                    "This file was deleted since it was indexed",
-                )
-
-            else:
-                indexed_time = fields["modtime"]
-                mtime = os.path.getmtime(indexed_path)
-                if mtime > indexed_time:
-                    index_writer.delete_by_term("path", indexed_path)
-                    to_index.add(os.path.join(bib_dir, indexed_path))
-                    print(
-                        citekey,
-                        original_filename,
-                        "The file has changed, delete and reindex",
-                    )
-
-    for path in list_all_docs_in_bibliography(bib_dir=bib_dir):
-        if path in to_index or path not in indexed_paths:
+    paths = {}
+    for entry_dir in entry_dirs:
+        for path in Entry.list_ocr_paths(entry_dir, snapshot=snapshot):
             citekey, original_filename = _split_path(path)
-            add_doc(index_writer=index_writer, path=path)
+            indexed_path = os.path.join(
+                citekey, "ocr", original_filename + ".tar"
+            )
+            paths[indexed_path] = path
+    duplicates = set()
+    if collapse_duplicates:
+        # Near-duplicates are found among all entries.
+        representatives = _remove_duplicates(
+            bib_dir=bib_dir,
+            paths=paths,
+            snapshot=None if partial else snapshot,
+        )
+        duplicates = set(paths) - set(representatives)
+        paths = representatives
+
+    to_delete = []
+    for indexed_path in manifest:
+        if citekeys is not None:
+            if _split_path(indexed_path)[0] not in citekeys:
+                continue
+        if indexed_path not in paths:
+            citekey, original_filename = _split_path(indexed_path)
+            print(
+                citekey,
+                original_filename,
+                "Delete from Index.",
+                (
+                    "This file is a near-duplicate of another file"
+                    if indexed_path in duplicates
+                    else "This file was deleted since it was indexed"
+                ),
+            )
+            to_delete.append(indexed_path)
+
+    to_index = []
+    for indexed_path in paths:
+        if indexed_path not in manifest:
+            to_index.append(indexed_path)
+            continue
+        record = (
+            dict(manifest[indexed_path]) if manifest[indexed_path] else None
+        )
+        if _is_unchanged(record, paths[indexed_path], snapshot):
+            if record != manifest[indexed_path]:
+                manifest[indexed_path] = record
+                manifest_changed = True
+        else:
+            citekey, original_filename = _split_path(indexed_path)
+            print(
+                citekey,
+                original_filename,
+                "The file has changed, delete and reindex",
+            )
+            to_index.append(indexed_path)
 
-    index_writer.commit()
+    if len(to_delete) == 0 and len(to_index) == 0:
+        if manifest_changed:
+            write_manifest(
+                index_dir, manifest, collapse_duplicates=collapse_duplicates
+            )
+        return
+
+    index_writer = open_writer(
+        index=index, num_procs=num_procs, limitmb=limitmb
+    )
+    for indexed_path in to_delete:
+        index_writer.delete_by_term("path", indexed_path)
+        manifest.pop(indexed_path)
+
+    if len(to_index) > 0:
+        metadata = read_metadata(
+            bib_dir=bib_dir,
+            snapshot=snapshot,
+            entry_dirs=[e for e in entry_dirs if snapshot.isdir(e)],
+        )
+    for indexed_path in to_index:
+        # Also when not in the manifest, the document might be in the index
+        # when a previous update was interrupted after its commit.
+        index_writer.delete_by_term("path", indexed_path)
+        path = paths[indexed_path]
+        citekey, original_filename = _split_path(path)
+        add_doc(
+            index_writer=index_writer,
+            path=path,
+            metadata=metadata.get(citekey, None),
+            modtime=get_doc_modtime(path=path, snapshot=snapshot),
+        )
+        manifest[indexed_path] = make_manifest_record(path, snapshot)
+
+    with Profile.stage("index_commit"):
+        index_writer.commit()
+    write_manifest(
+        index_dir, manifest, collapse_duplicates=collapse_duplicates
+    )
 
 
 def get_index_dir(bib_dir):
@@ -112,12 +626,87 @@ def get_index_dir(bib_dir):
     )
 
 
+def get_index_size(index_dir):
+    size = 0
+    for filename in os.listdir(index_dir):
+        size += os.stat(os.path.join(index_dir, filename)).st_size
+    return size
+
+
+def migrate_index(
+    bib_dir,
+    per_page=None,
+    store_content=None,
+    num_procs=1,
+    limitmb=128,
+    collapse_duplicates=None,
+):
+    """
+    Rebuilds the search-index from scratch, optionally with a different
+    layout. The new index is built next to the current one and replaces it
+    only when complete.
+    Returns the sizes in bytes of the index before and after.
+
+    Parameters
+    ----------
+    per_page : bool (None)
+            See get_schema. None keeps the layout of the current index.
+    store_content : bool (None)
+            See get_schema. None keeps the layout of the current index.
+    collapse_duplicates : bool (None)
+            Index only one document of each cluster of near-duplicates,
+            see Dedup. None keeps the setting of the current index.
+    """
+    bib_dir = os.path.normpath(bib_dir)
+    index_dir = get_index_dir(bib_dir)
+    size_before = 0
+    if whoosh.index.exists_in(index_dir):
+        schema = whoosh.index.open_dir(index_dir).schema
+        if per_page is None:
+            per_page = is_per_page(schema)
+        if store_content is None:
+            store_content = is_content_stored(schema)
+        size_before = get_index_size(index_dir)
+    if collapse_duplicates is None:
+        collapse_duplicates = read_collapse_duplicates(index_dir)
+    per_page = bool(per_page)
+    store_content = True if store_content is None else store_content
+
+    new_index_dir = index_dir + ".new"
+    old_index_dir = index_dir + ".old"
+    for path in [new_index_dir, old_index_dir]:
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    os.makedirs(new_index_dir)
+
+    make_clean_index(
+        bib_dir=bib_dir,
+        num_procs=num_procs,
+        limitmb=limitmb,
+        index_dir=new_index_dir,
+        per_page=per_page,
+        store_content=store_content,
+        collapse_duplicates=collapse_duplicates,
+    )
+    size_after = get_index_size(new_index_dir)
+
+    if os.path.exists(index_dir):
+        os.rename(index_dir, old_index_dir)
+    os.rename(new_index_dir, index_dir)
+    if os.path.exists(old_index_dir):
+        shutil.rmtree(old_index_dir)
+    return size_before, size_after
+
+
 def list_entries(bib_dir):
     ix = whoosh.index.open_dir(get_index_dir(bib_dir))
     all_documents = ix.searcher().documents()
     out = []
+    seen = set()
     for document in all_documents:
-        out.append(document["path"])
+        if document["path"] not in seen:
+            seen.add(document["path"])
+            out.append(document["path"])
     return out
 
 
@@ -133,29 +722,117 @@ def _split_path(path):
 
 
 class Search:
-    def __init__(self, bib_dir):
-        self.ix = whoosh.index.open_dir(get_index_dir(bib_dir))
+    """
+    Keeps the index, a searcher, and the query-parser open for multiple
+    searches. Call refresh() to see changes made to the index since.
+    """
+
+    def __init__(self, bib_dir, index_dir=None):
+        self.bib_dir = os.path.normpath(bib_dir)
+        if index_dir is None:
+            index_dir = get_index_dir(bib_dir)
+        self.index_dir = index_dir
+        self.metadata = Bibtex.MetadataCache(bib_dir=self.bib_dir)
+        self._open()
+
+    def _open(self):
+        self._index_dir_inode = os.stat(self.index_dir).st_ino
+        self.ix = whoosh.index.open_dir(self.index_dir)
+        self.searcher = self.ix.searcher()
+        self.qparser = whoosh.qparser.QueryParser("content", self.ix.schema)
+
+    def refresh(self):
+        """
+        Reopens the index when it was rebuilt, e.g. by migrate_index, and
+        reopens the searcher when segments were added or removed.
+        """
+        if os.stat(self.index_dir).st_ino != self._index_dir_inode:
+            self.close()
+            self._open()
+        else:
+            # refresh() closes the old reader itself when it returns a new
+            # searcher.
+            self.searcher = self.searcher.refresh()
+
+    def close(self):
+        self.searcher.close()
+
+    def _read_text(self, hit):
+        """
+        Returns the text of the hit from the string-archive.
+        Only used when the content is not stored in the index. The text is
+        limited like in add_doc, so highlights only come from indexed text.
+        """
+        with Reader.open_string_archive(
+            path=os.path.join(self.bib_dir, hit["path"])
+        ) as arc:
+            if is_per_page(self.ix.schema):
+                return arc[hit["page"]]
+            content, num_pages = _join_pages(
+                pages=_iter_pages(arc), max_content_size=MAX_CONTENT_SIZE
+            )
+            return content
+
+    def _highlights(self, hit):
+        if is_content_stored(self.ix.schema):
+            return hit.highlights("content")
+        try:
+            text = self._read_text(hit)
+        except Exception as err:
+            print(err, file=sys.stderr)
+            return ""
+        return hit.highlights("content", text=text)
+
+    def search(self, querystring, limit=10, offset=0, highlights=True):
+        """
+        Returns the hits ranked by their score.
+
+        Parameters
+        ----------
+        querystring : str
+                The phrase to search for.
+        limit : int (10)
+                Max. number of hits to be returned.
+        offset : int (0)
+                Number of best hits to be skipped, e.g. for the second page
+                of hits offset=limit.
+        highlights : bool (True)
+                If True, each hit has a 'highlight' of the matching text.
+
+        Each hit is a dict with 'citekey', 'original', 'rank', 'score',
+        the 'fields' title, author, and year, and 'page' when the index is
+        per page.
+        """
+        if limit < 1 or offset < 0:
+            raise ValueError(
+                "Expected limit >= 1 and offset >= 0, "
+                "but got limit={:d} and offset={:d}.".format(limit, offset)
+            )
+        myquery = self.qparser.parse(querystring)
+        hits = self.searcher.search(myquery, limit=offset + limit)
+        stop = min([offset + limit, hits.scored_length()])
 
-    def search(self, querystring):
-        qparser = whoosh.qparser.QueryParser("content", self.ix.schema)
-        myquery = qparser.parse(querystring)
         out = []
-        with self.ix.searcher() as searcher:
-            hits = searcher.search(myquery)
-            for hit in hits:
-                citekey, original_filename = _split_path(hit["path"])
-                out.append(
-                    {
-                        "citekey": citekey,
-                        "original": original_filename,
-                        "highlight": hit.highlights(
-                            "content",
-                        ),
-                    }
-                )
+        for rank in range(offset, stop):
+            hit = hits[rank]
+            citekey, original_filename = _split_path(hit["path"])
+            result = {
+                "citekey": citekey,
+                "original": original_filename,
+                "rank": rank,
+                "score": hit.score,
+            }
+            if highlights:
+                result["highlight"] = self._highlights(hit)
+            if is_per_page(self.ix.schema):
+                result["page"] = hit["page"]
+            out.append(result)
+
+        fields = self.metadata.get([result["citekey"] for result in out])
+        for result in out:
+            result["fields"] = fields[result["citekey"]]
         return out
 
     def correct(self, mistyped_word):
-        with self.ix.searcher() as searcher:
-            corrector = searcher.corrector("content")
-            print(corrector.suggest(mistyped_word, limit=3))
+        corrector = self.searcher.corrector("content")
+        print(corrector.suggest(mistyped_word, limit=3))
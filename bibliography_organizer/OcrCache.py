@@ -0,0 +1,148 @@
+"""
+A content-addressed cache of string-archives.
+
+The string-archive of an original is stored under the hash of the original's
+bytes. When an original is renamed, moved to another entry, or exists in
+multiple entries, its string-archive is linked from the cache instead of
+running the optical-character-recognition again.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+from . import Profile
+
+OCR_CACHE_DIRNAME = "ocr_cache"
+MAX_CACHE_SIZE = 1e9
+
+
+def get_cache_dir(bib_dir):
+    # Entry reads MAX_CACHE_SIZE while Bibliography is being imported.
+    from . import Bibliography
+
+    bib_dir = os.path.normpath(bib_dir)
+    return os.path.join(
+        bib_dir, Bibliography.HIDDEN_WORK_DIRNAME, OCR_CACHE_DIRNAME
+    )
+
+
+def hash_file(path, block_size=2**20):
+    with Profile.stage("hash") as record:
+        h = hashlib.sha256()
+        num_bytes = 0
+        with open(path, "rb") as f:
+            block = f.read(block_size)
+            while block:
+                h.update(block)
+                num_bytes += len(block)
+                block = f.read(block_size)
+        record["bytes"] = num_bytes
+    return h.hexdigest()
+
+
+def _archive_path(cache_dir, content_hash):
+    return os.path.join(cache_dir, content_hash + ".tar")
+
+
+def _stamp_path(cache_dir, content_hash):
+    return os.path.join(cache_dir, content_hash + ".used")
+
+
+def _touch(path):
+    with open(path, "ab"):
+        pass
+    os.utime(path)
+
+
+def _link_or_copy(src, dst):
+    """
+    Links, or where this is not possible copies, src to dst. The temporary
+    file has a unique name, so that processes putting the same
+    string-archive at the same time do not write into each other's file.
+    """
+    fd, tmp_dst = tempfile.mkstemp(
+        dir=os.path.dirname(dst),
+        prefix="." + os.path.basename(dst) + ".",
+        suffix=".part",
+    )
+    os.close(fd)
+    try:
+        try:
+            os.remove(tmp_dst)
+            os.link(src, tmp_dst)
+        except OSError:
+            shutil.copyfile(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    finally:
+        # os.replace keeps tmp_dst when it is a link to dst already.
+        try:
+            os.remove(tmp_dst)
+        except FileNotFoundError:
+            pass
+
+
+def get(cache_dir, content_hash, out_path):
+    """
+    Links the cached string-archive of content_hash to out_path.
+    Returns False when there is no such string-archive in the cache.
+    """
+    with Profile.stage("cache"):
+        archive_path = _archive_path(cache_dir, content_hash)
+        if not os.path.exists(archive_path):
+            return False
+        _link_or_copy(src=archive_path, dst=out_path)
+        _touch(_stamp_path(cache_dir, content_hash))
+        return True
+
+
+def put(cache_dir, content_hash, path, max_cache_size=MAX_CACHE_SIZE):
+    """
+    Adds the string-archive in path to the cache and evicts the least
+    recently used string-archives when the cache exceeds max_cache_size.
+    """
+    with Profile.stage("cache"):
+        os.makedirs(cache_dir, exist_ok=True)
+        _link_or_copy(src=path, dst=_archive_path(cache_dir, content_hash))
+        _touch(_stamp_path(cache_dir, content_hash))
+        evict(cache_dir=cache_dir, max_cache_size=max_cache_size)
+
+
+def evict(cache_dir, max_cache_size=MAX_CACHE_SIZE):
+    """
+    Removes the least recently used string-archives until the size of the
+    cache is below max_cache_size.
+    The time of last use is the mtime of the archive's stamp-file. The
+    archive itself is not touched as it may be a hard-link to an entry's
+    ocr/*.tar.
+    """
+    records = []
+    total_size = 0
+    for filename in os.listdir(cache_dir):
+        content_hash, ext = os.path.splitext(filename)
+        if ext != ".tar":
+            continue
+        try:
+            size = os.stat(os.path.join(cache_dir, filename)).st_size
+        except FileNotFoundError:
+            continue
+        try:
+            last_use = os.stat(_stamp_path(cache_dir, content_hash)).st_mtime
+        except FileNotFoundError:
+            last_use = 0.0
+        records.append((last_use, content_hash, size))
+        total_size += size
+
+    records.sort()
+    for last_use, content_hash, size in records:
+        if total_size <= max_cache_size:
+            break
+        for path in [
+            _archive_path(cache_dir, content_hash),
+            _stamp_path(cache_dir, content_hash),
+        ]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total_size -= size
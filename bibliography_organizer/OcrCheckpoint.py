@@ -0,0 +1,90 @@
+"""
+Checkpoints of the optical-character-recognition of long documents.
+
+Each recognized page is written into a checkpoint-directory named after
+the hash of the original's bytes. When the recognition of a document is
+interrupted, the next attempt only recognizes the pages which are not yet
+in the checkpoint. The checkpoint is removed once the document's
+string-archive is complete.
+"""
+
+import os
+import time
+import shutil
+from . import Bibliography
+
+OCR_CHECKPOINT_DIRNAME = "ocr_checkpoints"
+MAX_AGE = 30 * 24 * 3600
+
+
+def get_checkpoint_root(bib_dir):
+    bib_dir = os.path.normpath(bib_dir)
+    return os.path.join(
+        bib_dir, Bibliography.HIDDEN_WORK_DIRNAME, OCR_CHECKPOINT_DIRNAME
+    )
+
+
+def get_checkpoint_dir(checkpoint_root, content_hash):
+    return os.path.join(checkpoint_root, content_hash)
+
+
+def _page_path(checkpoint_dir, page_number):
+    return os.path.join(checkpoint_dir, "{:06d}.txt".format(page_number))
+
+
+def read_pages(checkpoint_dir):
+    """
+    Returns a dict page_number -> page_string of the pages in the
+    checkpoint. Returns an empty dict when there is no checkpoint.
+    """
+    pages = {}
+    try:
+        filenames = os.listdir(checkpoint_dir)
+    except FileNotFoundError:
+        return pages
+    for filename in filenames:
+        if str.startswith(filename, ".") or not str.endswith(filename, ".txt"):
+            continue
+        page_number = int(filename[0:6])
+        with open(os.path.join(checkpoint_dir, filename), "rb") as f:
+            pages[page_number] = f.read().decode()
+    return pages
+
+
+def write_page(checkpoint_dir, page_number, page_string):
+    """
+    Writes the page into the checkpoint. A page is either complete or does
+    not exist.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = _page_path(checkpoint_dir, page_number)
+    tmp_path = os.path.join(
+        checkpoint_dir, "." + os.path.basename(path) + ".part"
+    )
+    with open(tmp_path, "wb") as f:
+        f.write(page_string.encode())
+    os.replace(tmp_path, path)
+
+
+def remove(checkpoint_dir):
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+
+def evict(checkpoint_root, max_age=MAX_AGE):
+    """
+    Removes the checkpoints which were not written to for max_age seconds,
+    e.g. of originals which were changed or removed meanwhile.
+    """
+    try:
+        content_hashes = os.listdir(checkpoint_root)
+    except FileNotFoundError:
+        return
+    now = time.time()
+    for content_hash in content_hashes:
+        checkpoint_dir = get_checkpoint_dir(checkpoint_root, content_hash)
+        try:
+            mtime = os.stat(checkpoint_dir).st_mtime
+        except FileNotFoundError:
+            continue
+        if now - mtime > max_age:
+            remove(checkpoint_dir)
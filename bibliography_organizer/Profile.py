@@ -0,0 +1,282 @@
+"""
+Records the wall-time, cpu-time, and number of bytes of the stages of an
+update, e.g. rendering pages, recognizing characters, writing
+string-archives, making icons, and committing the search-index.
+
+Recording is off by default. Call enable() to start recording. Each stage
+is recorded for the entry and the document it works on.
+"""
+
+import os
+import sys
+import json
+import time
+import contextlib
+import threading
+
+STAGES = [
+    "document",
+    "text_layer",
+    "render",
+    "ocr",
+    "write",
+    "hash",
+    "cache",
+    "icon",
+    "index_add",
+    "index_commit",
+]
+
+_recorder = None
+_local = threading.local()
+
+
+class Recorder:
+    """
+    Collects the records of the stages. A record is a dict with the
+    'stage', the 'entry', the 'document', the 'start' (unix-time in s),
+    the 'wall' and 'cpu' durations in s, the 'bytes', and the 'pid' and
+    'tid' it ran in.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, records):
+        with self._lock:
+            self.records += records
+
+
+def enable():
+    """
+    Starts recording and returns the Recorder.
+    """
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    """
+    Stops recording and returns the Recorder, or None when not recording.
+    """
+    global _recorder
+    recorder = _recorder
+    _recorder = None
+    return recorder
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def current_labels():
+    """
+    Returns the entry and document of the stages in this thread.
+    """
+    return dict(getattr(_local, "labels", {}))
+
+
+@contextlib.contextmanager
+def labels(entry=None, document=None):
+    """
+    Within this context, stages in this thread are recorded for this entry
+    and document.
+    """
+    previous = current_labels()
+    new = dict(previous)
+    if entry is not None:
+        new["entry"] = entry
+    if document is not None:
+        new["document"] = document
+    _local.labels = new
+    try:
+        yield
+    finally:
+        _local.labels = previous
+
+
+def _children_cpu_time():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+@contextlib.contextmanager
+def stage(name, entry=None, document=None):
+    """
+    Records the stage when recording is enabled. Yields the record, so that
+    the caller can set its 'bytes'.
+
+    The 'cpu' time is the time of this thread, plus the time of the
+    subprocesses which ended meanwhile, e.g. ImageMagick and tesseract.
+    When other threads run subprocesses at the same time, their time may be
+    counted here as well.
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield {}
+        return
+
+    record = {"stage": name, "bytes": 0}
+    record.update(current_labels())
+    if entry is not None:
+        record["entry"] = entry
+    if document is not None:
+        record["document"] = document
+
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time() + _children_cpu_time()
+    try:
+        with labels(entry=entry, document=document):
+            yield record
+    finally:
+        record["start"] = start
+        record["wall"] = time.perf_counter() - wall_start
+        record["cpu"] = time.thread_time() + _children_cpu_time() - cpu_start
+        record["pid"] = os.getpid()
+        record["tid"] = threading.get_ident()
+        recorder.add([record])
+
+
+def submit(pool, fn, *args, **kwargs):
+    """
+    Like pool.submit(fn, *args, **kwargs). When recording is enabled, the
+    stages of fn are recorded for the entry and document of this thread.
+    Also when the pool runs fn in another process, its records are
+    collected here once the result was taken.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return pool.submit(fn, *args, **kwargs)
+    future = pool.submit(
+        _call_and_record, recorder.pid, current_labels(), fn, args, kwargs
+    )
+    return _Future(future=future, recorder=recorder)
+
+
+def _call_and_record(parent_pid, stage_labels, fn, args, kwargs):
+    global _recorder
+    if os.getpid() == parent_pid:
+        with labels(**stage_labels):
+            return fn(*args, **kwargs), []
+
+    _recorder = Recorder()
+    try:
+        with labels(**stage_labels):
+            result = fn(*args, **kwargs)
+        return result, _recorder.records
+    finally:
+        _recorder = None
+
+
+class _Future:
+    def __init__(self, future, recorder):
+        self._future = future
+        self._recorder = recorder
+        self._collected = False
+
+    def result(self, timeout=None):
+        result, records = self._future.result(timeout=timeout)
+        if not self._collected:
+            self._recorder.add(records)
+            self._collected = True
+        return result
+
+
+def summarize(records, key="stage"):
+    """
+    Returns a dict key -> totals of 'count', 'wall', 'cpu', and 'bytes'
+    over the records. key is 'stage', 'entry', or 'document'.
+    """
+    out = {}
+    for record in records:
+        k = record.get(key, None)
+        if k is None:
+            continue
+        if k not in out:
+            out[k] = {"count": 0, "wall": 0.0, "cpu": 0.0, "bytes": 0}
+        out[k]["count"] += 1
+        out[k]["wall"] += record["wall"]
+        out[k]["cpu"] += record["cpu"]
+        out[k]["bytes"] += record["bytes"]
+    return out
+
+
+def _print_table(title, totals, names, file):
+    print("", file=file)
+    print(
+        "{:32s} {:>7s} {:>10s} {:>10s} {:>12s}".format(
+            title, "count", "wall/s", "cpu/s", "MB"
+        ),
+        file=file,
+    )
+    print("-" * 75, file=file)
+    for name in names:
+        t = totals[name]
+        print(
+            "{:32s} {:7d} {:10.3f} {:10.3f} {:12.3f}".format(
+                str(name)[0:32],
+                t["count"],
+                t["wall"],
+                t["cpu"],
+                t["bytes"] * 1e-6,
+            ),
+            file=file,
+        )
+
+
+def print_summary(records, num_slowest=10, file=sys.stdout):
+    """
+    Prints the totals of each stage, and of the slowest entries and
+    documents.
+
+    Stages run in parallel and stages contain each other, e.g. 'document'
+    contains 'render', 'ocr', and 'write'. So the wall-times do not add up
+    to the duration of the update.
+    """
+    by_stage = summarize(records, key="stage")
+    names = [s for s in STAGES if s in by_stage]
+    names += sorted([s for s in by_stage if s not in STAGES])
+    _print_table("stage", by_stage, names, file)
+
+    for key in ["entry", "document"]:
+        # Only the outermost stages, so nothing is counted twice.
+        outer = [r for r in records if r["stage"] in ["document", "icon"]]
+        totals = summarize(outer, key=key)
+        names = sorted(totals, key=lambda n: totals[n]["wall"], reverse=True)
+        if len(names):
+            _print_table("slowest " + key, totals, names[0:num_slowest], file)
+
+
+def write_json(path, records):
+    with open(path, "wt") as f:
+        f.write(json.dumps({"records": records}, indent=1))
+
+
+def write_chrome_trace(path, records):
+    """
+    Writes the records in the trace-event-format, which can be opened in
+    chrome://tracing or in https://ui.perfetto.dev.
+    """
+    events = []
+    for record in records:
+        args = {"cpu": record["cpu"], "bytes": record["bytes"]}
+        for key in ["entry", "document"]:
+            if key in record:
+                args[key] = record[key]
+        events.append(
+            {
+                "name": record["stage"],
+                "ph": "X",
+                "ts": record["start"] * 1e6,
+                "dur": record["wall"] * 1e6,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": args,
+            }
+        )
+    with open(path, "wt") as f:
+        f.write(json.dumps({"traceEvents": events}))
@@ -1,65 +1,652 @@
-import pytesseract
-import PIL
 import io
+import json
+import mmap
+import gzip
 import tarfile
-import shutil
+import contextlib
 import os
-import glob
 import tempfile
+import queue
+import threading
+import collections
+import unicodedata
 from . import Document
+from . import OcrCheckpoint
+from . import Profile
 
 
 def parse_image_to_string(image_path):
-    with PIL.Image.open(image_path) as img:
-        s = pytesseract.image_to_string(img)
+    # pytesseract and PIL are imported here as they are slow to import and
+    # only needed to read characters.
+    import pytesseract
+    import PIL.Image
+
+    with Profile.stage("ocr") as record:
+        with PIL.Image.open(image_path) as img:
+            s = pytesseract.image_to_string(img)
+        record["bytes"] = len(s.encode())
     return s
 
 
-def document_to_string_archive(document_path, out_path):
+def _recognize_page(image_path, checkpoint_dir):
+    page_string = parse_image_to_string(image_path)
+    if checkpoint_dir is not None:
+        OcrCheckpoint.write_page(
+            checkpoint_dir=checkpoint_dir,
+            page_number=1 + int(os.path.basename(image_path)[0:6]),
+            page_string=page_string,
+        )
+    return page_string
+
+
+TEXT_LAYER_MIN_NUM_CHARS = 32
+TEXT_LAYER_MIN_ALNUM_FRACTION = 0.5
+TEXT_LAYER_MAX_INVALID_FRACTION = 0.05
+
+
+def is_text_layer_usable(page_string):
+    """
+    Returns False when the embedded text of a page is missing or garbled,
+    i.e. when the page has to be read using optical character recognition.
+
+    Text is garbled when it has replacement-, control-, or private-use
+    characters, e.g. from fonts without a unicode-map, or when it is mostly
+    symbols instead of letters and digits.
+    """
+    num_chars = 0
+    num_alnum = 0
+    num_invalid = 0
+    for c in page_string:
+        if c.isspace():
+            continue
+        num_chars += 1
+        if c.isalnum():
+            num_alnum += 1
+        elif c == "\ufffd" or unicodedata.category(c) in ["Cc", "Co", "Cn"]:
+            num_invalid += 1
+    if num_chars < TEXT_LAYER_MIN_NUM_CHARS:
+        return False
+    if num_alnum < TEXT_LAYER_MIN_ALNUM_FRACTION * num_chars:
+        return False
+    return num_invalid <= TEXT_LAYER_MAX_INVALID_FRACTION * num_chars
+
+
+def document_to_string_archive(
+    document_path,
+    out_path,
+    pool=None,
+    chunk_size=8,
+    max_pages_in_flight=8,
+    compression=None,
+    text_extractor="pdftotext",
+    checkpoint_dir=None,
+):
+    """
+    Reads the text of each page in the document and writes the pages into a
+    string-archive.
+
+    First, the text embedded in the document is extracted. Only the pages
+    where this text is missing or garbled, see is_text_layer_usable, are
+    rendered and read using optical character recognition.
+
+    The pages are rendered in a background-thread while the pages rendered
+    so far are recognized. Each page is appended to the string-archive as
+    soon as it was recognized and its image is removed right away.
+
+    Parameters
+    ----------
+    document_path : str
+            Path to the document.
+    out_path : str
+            Path of the string-archive (tar) to be written.
+    pool : concurrent.futures.Executor (None)
+            When given, the pages are recognized in parallel in this pool.
+            The pages are still written in order. A pool of processes must
+            not fork its workers, as they are started while the renderer
+            runs, see Bibliography.make_process_pool.
+    chunk_size : int (8)
+            Number of pages rendered at once.
+    max_pages_in_flight : int (8)
+            Max. number of pages which were handed to the pool but were not
+            yet written to the string-archive.
+    compression : str (None)
+            The compression of the pages, see write_string_archive.
+    text_extractor : str ("pdftotext")
+            The extractor of the embedded text, see
+            Document.extract_text_layer. None reads all pages using optical
+            character recognition.
+    checkpoint_dir : str (None)
+            When given, each recognized page is written into this
+            checkpoint, see OcrCheckpoint. Pages which are already in the
+            checkpoint are not recognized again. The checkpoint is removed
+            once the string-archive is complete.
+    """
     out_path = os.path.normpath(out_path)
     out_dirname = os.path.dirname(out_path)
     os.makedirs(out_dirname, exist_ok=True)
 
+    with Profile.stage("document") as record:
+        text_pages = collections.deque()
+        ocr_pages = None
+        if text_extractor is not None:
+            text_layer = Document.extract_text_layer(
+                document_path=document_path, extractor=text_extractor
+            )
+            if text_layer is not None:
+                ocr_pages = []
+                for page_index, page_string in enumerate(text_layer):
+                    if is_text_layer_usable(page_string):
+                        text_pages.append((page_index + 1, page_string))
+                    else:
+                        ocr_pages.append(page_index)
+
+        if checkpoint_dir is not None:
+            text_pages, ocr_pages = _resume_from_checkpoint(
+                document_path=document_path,
+                checkpoint_dir=checkpoint_dir,
+                text_pages=text_pages,
+                ocr_pages=ocr_pages,
+            )
+
+        _document_to_string_archive(
+            document_path=document_path,
+            out_path=out_path,
+            pool=pool,
+            chunk_size=chunk_size,
+            max_pages_in_flight=max_pages_in_flight,
+            compression=compression,
+            text_pages=text_pages,
+            ocr_pages=ocr_pages,
+            checkpoint_dir=checkpoint_dir,
+        )
+        record["bytes"] = os.path.getsize(out_path)
+    if checkpoint_dir is not None:
+        OcrCheckpoint.remove(checkpoint_dir)
+
+
+def _resume_from_checkpoint(
+    document_path, checkpoint_dir, text_pages, ocr_pages
+):
+    """
+    Returns text_pages and ocr_pages where the pages which are already in
+    the checkpoint are moved from ocr_pages to text_pages.
+    When ocr_pages is None and the number of pages can not be read, nothing
+    is resumed.
+    """
+    checkpoint_pages = OcrCheckpoint.read_pages(checkpoint_dir)
+    if len(checkpoint_pages) == 0:
+        return text_pages, ocr_pages
+    if ocr_pages is None:
+        num_pages = Document.count_pages(document_path=document_path)
+        if num_pages is None:
+            return text_pages, ocr_pages
+        ocr_pages = list(range(num_pages))
+
+    resumed_pages = []
+    remaining_ocr_pages = []
+    for page_index in ocr_pages:
+        if page_index + 1 in checkpoint_pages:
+            resumed_pages.append(
+                (page_index + 1, checkpoint_pages[page_index + 1])
+            )
+        else:
+            remaining_ocr_pages.append(page_index)
+    text_pages = collections.deque(sorted(list(text_pages) + resumed_pages))
+    return text_pages, remaining_ocr_pages
+
+
+def _document_to_string_archive(
+    document_path,
+    out_path,
+    pool,
+    chunk_size,
+    max_pages_in_flight,
+    compression,
+    text_pages,
+    ocr_pages,
+    checkpoint_dir,
+):
+    """
+    Writes the text_pages, a deque of (page_number, page_string), and the
+    recognized text of the ocr_pages, a list of page-indices, in the order
+    of the pages. ocr_pages None recognizes all pages.
+    """
+    if ocr_pages is not None and len(ocr_pages) == 0:
+        with _open_string_archive_for_writing(
+            out_path, compression=compression
+        ) as writer:
+            _add_text_pages_to_string_archive(
+                writer=writer, text_pages=text_pages
+            )
+        return
+
     with tempfile.TemporaryDirectory() as tmp_dir:
+        image_queue = queue.Queue(maxsize=chunk_size)
+        stop = threading.Event()
+        renderer = threading.Thread(
+            target=_render_images_into_queue,
+            kwargs={
+                "document_path": document_path,
+                "out_dir": tmp_dir,
+                "chunk_size": chunk_size,
+                "image_queue": image_queue,
+                "stop": stop,
+                "pages": ocr_pages,
+                "labels": Profile.current_labels(),
+            },
+        )
+        renderer.start()
+        try:
+            with _open_string_archive_for_writing(
+                out_path, compression=compression
+            ) as writer:
+                in_flight = collections.deque()
+                for image_path in _iter_queue(image_queue):
+                    if pool is None:
+                        page_string = _recognize_page(
+                            image_path, checkpoint_dir
+                        )
+                        _add_image_page_to_string_archive(
+                            writer=writer,
+                            image_path=image_path,
+                            page_string=page_string,
+                            text_pages=text_pages,
+                        )
+                    else:
+                        future = Profile.submit(
+                            pool, _recognize_page, image_path, checkpoint_dir
+                        )
+                        in_flight.append((image_path, future))
+                        while len(in_flight) >= max_pages_in_flight:
+                            image_path, future = in_flight.popleft()
+                            _add_image_page_to_string_archive(
+                                writer=writer,
+                                image_path=image_path,
+                                page_string=future.result(),
+                                text_pages=text_pages,
+                            )
+                while len(in_flight):
+                    image_path, future = in_flight.popleft()
+                    _add_image_page_to_string_archive(
+                        writer=writer,
+                        image_path=image_path,
+                        page_string=future.result(),
+                        text_pages=text_pages,
+                    )
+                _add_text_pages_to_string_archive(
+                    writer=writer, text_pages=text_pages
+                )
+        finally:
+            stop.set()
+            renderer.join()
+
+
+def _render_images_into_queue(
+    document_path, out_dir, chunk_size, image_queue, stop, labels, pages
+):
+    try:
+        with Profile.labels(**labels):
+            for image_path in Document.iter_images(
+                document_path=document_path,
+                out_dir=out_dir,
+                image_format="jpg",
+                chunk_size=chunk_size,
+                pages=pages,
+            ):
+                if not _put_unless_stopped(image_queue, image_path, stop):
+                    return
+        _put_unless_stopped(image_queue, None, stop)
+    except Exception as err:
+        _put_unless_stopped(image_queue, err, stop)
+
+
+def _put_unless_stopped(image_queue, item, stop):
+    while not stop.is_set():
+        try:
+            image_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _iter_queue(image_queue):
+    while True:
+        item = image_queue.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _add_text_pages_to_string_archive(writer, text_pages, before=None):
+    """
+    Adds and removes the text_pages with page-numbers before 'before', or
+    all text_pages when before is None.
+    """
+    while len(text_pages):
+        if before is not None and text_pages[0][0] >= before:
+            break
+        page_number, page_string = text_pages.popleft()
+        _add_page_to_string_archive(
+            writer=writer,
+            page_number=page_number,
+            page_string=page_string,
+        )
+
+
+def _add_image_page_to_string_archive(
+    writer, image_path, page_string, text_pages
+):
+    page_number = 1 + int(os.path.basename(image_path)[0:6])
+    _add_text_pages_to_string_archive(
+        writer=writer, text_pages=text_pages, before=page_number
+    )
+    _add_page_to_string_archive(
+        writer=writer,
+        page_number=page_number,
+        page_string=page_string,
+    )
+    os.remove(image_path)
+
+
+PAGE_OFFSETS_FILENAME = "page_offsets.json"
+STRING_ARCHIVE_VERSION = 1
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _compress(page_bytes, compression):
+    if compression is None:
+        return page_bytes
+    if compression == "gzip":
+        return gzip.compress(page_bytes, mtime=0)
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(page_bytes)
+    raise KeyError("Unknown compression '{:s}'.".format(compression))
 
-        Document.convert_to_images(
-            document_path=document_path, out_dir=tmp_dir, image_format="jpg"
+
+def _decompress(page_bytes, compression):
+    if compression is None:
+        return page_bytes
+    if compression == "gzip":
+        return gzip.decompress(page_bytes)
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(page_bytes)
+    raise KeyError("Unknown compression '{:s}'.".format(compression))
+
+
+def _parse_page_name(name):
+    """
+    Returns the page-number and the compression of the page's name in the
+    string-archive, e.g. 'page_000001.txt.gz'.
+    """
+    assert str.startswith(name, "page_")
+    page_number = int(name[5:11])
+    ext = name[11:]
+    for compression in COMPRESSION_EXTENSIONS:
+        if ext == ".txt" + COMPRESSION_EXTENSIONS[compression]:
+            return page_number, compression
+    raise AssertionError("Not a page '{:s}'.".format(name))
+
+
+class _StringArchiveWriter:
+    """
+    Adds pages to the tar and keeps the offset and size of each page's
+    data. On close, the offsets are written into the last member
+    'page_offsets.json' of the tar.
+    """
+
+    def __init__(self, tarout, compression=None):
+        assert compression in COMPRESSION_EXTENSIONS
+        self.tarout = tarout
+        self.compression = compression
+        self.pages = {}
+
+    def add_page(self, page_number, page_string):
+        name = "page_{:06d}.txt".format(page_number)
+        name += COMPRESSION_EXTENSIONS[self.compression]
+        data = _compress(page_string.encode(), self.compression)
+        offset = self._add_member(name=name, data=data)
+        self.pages[str(page_number)] = [offset, len(data)]
+        return len(data)
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo()
+        info.name = name
+        info.size = len(data)
+        header = info.tobuf(
+            self.tarout.format, self.tarout.encoding, self.tarout.errors
         )
+        offset = self.tarout.offset + len(header)
+        self.tarout.addfile(tarinfo=info, fileobj=io.BytesIO(data))
+        return offset
+
+    def write_page_offsets(self):
+        page_offsets = {
+            "version": STRING_ARCHIVE_VERSION,
+            "compression": self.compression,
+            "pages": self.pages,
+        }
+        self._add_member(
+            name=PAGE_OFFSETS_FILENAME,
+            data=json.dumps(page_offsets).encode(),
+        )
+
+
+@contextlib.contextmanager
+def _open_string_archive_for_writing(out_path, compression=None):
+    """
+    Writes the string-archive into a hidden, temporary file next to out_path
+    and moves it to out_path only after it was written completely.
+    Thus an ocr/*.tar is either complete or does not exist.
+    """
+    out_path = os.path.normpath(out_path)
+    tmp_path = os.path.join(
+        os.path.dirname(out_path), "." + os.path.basename(out_path) + ".part"
+    )
+    try:
+        with tarfile.open(tmp_path, "w") as tarout:
+            writer = _StringArchiveWriter(
+                tarout=tarout, compression=compression
+            )
+            yield writer
+            writer.write_page_offsets()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+
+
+def _add_page_to_string_archive(writer, page_number, page_string):
+    with Profile.stage("write") as record:
+        record["bytes"] = writer.add_page(
+            page_number=page_number, page_string=page_string
+        )
+
+
+def write_string_archive(path, pages, compression=None):
+    """
+    Writes the pages into a string-archive in path.
 
-        image_paths = glob.glob(os.path.join(tmp_dir, "*.jpg"))
-        img_basenames = [os.path.basename(p) for p in image_paths]
-        img_basenames.sort()
-        image_paths = [os.path.join(tmp_dir, bn) for bn in img_basenames]
+    Parameters
+    ----------
+    path : str
+            Path of the string-archive (tar) to be written.
+    pages : dict
+            The text of each page, indexed by the page-number starting at 1.
+    compression : str (None)
+            Compress each page with 'gzip' or 'zstd'. The latter needs the
+            package zstandard. None does not compress.
+    """
+    with _open_string_archive_for_writing(
+        path, compression=compression
+    ) as writer:
+        for page_number in sorted(pages):
+            _add_page_to_string_archive(
+                writer=writer,
+                page_number=page_number,
+                page_string=pages[page_number],
+            )
 
-        tmp_out_path = os.path.join(tmp_dir, "out.tar")
-        with tarfile.open(tmp_out_path, "w") as tarout:
-            for image_path in image_paths:
-                page_number = 1 + int(os.path.basename(image_path)[0:6])
-                page_string = parse_image_to_string(image_path=image_path)
 
-                page_bytes = page_string.encode()
-                buff = io.BytesIO()
+class StringArchive:
+    """
+    Reads single pages of a string-archive without reading the others.
 
-                info = tarfile.TarInfo()
-                info.name = "page_{:06d}.txt".format(page_number)
-                info.size = buff.write(page_bytes)
+    The archive is memory-mapped. The offsets of the pages are read from its
+    'page_offsets.json', or, for archives written before there was one,
+    from the headers of its members. It behaves like a read-only dict
+    page-number -> text, and reads a page only when it is accessed.
 
-                buff.seek(0)
-                tarout.addfile(tarinfo=info, fileobj=buff)
-                buff.close()
-        shutil.move(src=tmp_out_path, dst=out_path)
+        with StringArchive(path) as arc:
+            text = arc[3]
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self.compression = None
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._mm = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self._mm = b""
+        self._pages = self._read_page_offsets()
+        if self._pages is None:
+            self._pages = self._scan_page_offsets()
+
+    def _find_page_offsets_member(self):
+        """
+        Returns the offset and size of the 'page_offsets.json', or None.
+        It is the last member of the tar. So the blocks are read backwards
+        from the end, past the zero-blocks which end the tar, until the
+        first valid header.
+        """
+        block_size = tarfile.BLOCKSIZE
+        i = len(self._mm) // block_size - 1
+        while i >= 0:
+            block = self._mm[i * block_size : (i + 1) * block_size]
+            if block.count(0) != block_size:
+                break
+            i -= 1
+        while i >= 0:
+            block = self._mm[i * block_size : (i + 1) * block_size]
+            try:
+                info = tarfile.TarInfo.frombuf(block, "utf-8", "strict")
+            except tarfile.HeaderError:
+                i -= 1
+                continue
+            if info.name != PAGE_OFFSETS_FILENAME:
+                return None
+            return (i + 1) * block_size, info.size
+        return None
+
+    def _read_page_offsets(self):
+        member = self._find_page_offsets_member()
+        if member is None:
+            return None
+        offset, size = member
+        page_offsets = json.loads(self._mm[offset : offset + size])
+        self.version = page_offsets["version"]
+        self.compression = page_offsets["compression"]
+        pages = {}
+        for page_number in page_offsets["pages"]:
+            offset, size = page_offsets["pages"][page_number]
+            pages[int(page_number)] = (offset, size, self.compression)
+        return pages
+
+    def _scan_page_offsets(self):
+        pages = {}
+        self._file.seek(0)
+        with tarfile.open(fileobj=self._file, mode="r:") as tarin:
+            for info in tarin:
+                if info.name == PAGE_OFFSETS_FILENAME:
+                    continue
+                page_number, compression = _parse_page_name(info.name)
+                pages[page_number] = (info.offset_data, info.size, compression)
+        return pages
+
+    def __getitem__(self, page_number):
+        offset, size, compression = self._pages[page_number]
+        page_bytes = _decompress(self._mm[offset : offset + size], compression)
+        return bytes.decode(page_bytes, encoding="utf-8")
+
+    def __contains__(self, page_number):
+        return page_number in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __iter__(self):
+        return iter(sorted(self._pages))
+
+    def keys(self):
+        return sorted(self._pages)
+
+    def items(self):
+        """
+        Yields (page-number, text) for each page in order. Only one page is
+        in memory at a time.
+        """
+        for page_number in sorted(self._pages):
+            yield page_number, self[page_number]
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_string_archive(path):
+    return StringArchive(path=path)
 
 
 def read_string_archive(path):
-    arc = {}
-    with tarfile.open(path, "r") as tarin:
-        for info in tarin:
-            assert str.endswith(info.name, ".txt")
-            assert str.startswith(info.name, "page_")
-            number_str = info.name[5:11]
-            page_number = int(number_str)
-            buff = tarin.extractfile(info)
-            text_b = buff.read()
-            text_u = bytes.decode(text_b, encoding="utf-8")
-            arc[page_number] = text_u
-    return arc
+    """
+    Returns a dict page-number -> text of all pages in the string-archive.
+    """
+    with StringArchive(path=path) as arc:
+        return dict(arc.items())
+
+
+def read_string_archive_page(path, page_number):
+    """
+    Returns the text of a single page in the string-archive.
+    """
+    with StringArchive(path=path) as arc:
+        return arc[page_number]
+
+
+def convert_string_archive(path, compression=None):
+    """
+    Rewrites the string-archive in the current version with the given
+    compression. Returns False when it already was.
+    """
+    with StringArchive(path=path) as arc:
+        if (
+            arc.version == STRING_ARCHIVE_VERSION
+            and arc.compression == compression
+        ):
+            return False
+        with _open_string_archive_for_writing(
+            path, compression=compression
+        ) as writer:
+            for page_number, page_string in arc.items():
+                writer.add_page(
+                    page_number=page_number, page_string=page_string
+                )
+    return True
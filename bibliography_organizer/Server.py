@@ -0,0 +1,152 @@
+"""
+A local search-server which keeps the search-index open.
+
+The server listens on a unix-socket in the hidden work-dir. A client sends
+one line of json, e.g. {"phrase": "neutrino", "limit": 10, "offset": 0,
+"highlights": true}, and receives one line of json with the search-results,
+i.e. {"results": [...]}, or {"error": "..."}.
+"""
+
+import os
+import sys
+import json
+import socket
+import hashlib
+import tempfile
+import socketserver
+from . import Bibliography
+
+SOCKET_FILENAME = "search.sock"
+MAX_SOCKET_PATH_LENGTH = 100
+
+
+def get_socket_path(bib_dir):
+    """
+    Returns the path of the server's unix-socket. Unix-sockets have a short
+    max. path-length. When the bib_dir is too deep, the socket is put into
+    the temporary directory instead.
+    """
+    bib_dir = os.path.abspath(bib_dir)
+    path = os.path.join(
+        bib_dir, Bibliography.HIDDEN_WORK_DIRNAME, SOCKET_FILENAME
+    )
+    if len(os.fsencode(path)) < MAX_SOCKET_PATH_LENGTH:
+        return path
+    bib_dir_hash = hashlib.sha1(os.fsencode(bib_dir)).hexdigest()[0:16]
+    return os.path.join(
+        tempfile.gettempdir(), "biborg-" + bib_dir_hash + ".sock"
+    )
+
+
+def query(bib_dir, phrase, limit=10, offset=0, highlights=True, timeout=10.0):
+    """
+    Returns the search-results from the server, or None when no server is
+    running for this bib_dir or when the server failed. See
+    Index.Search.search.
+    """
+    socket_path = get_socket_path(bib_dir)
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(
+                _encode(
+                    {
+                        "phrase": phrase,
+                        "limit": limit,
+                        "offset": offset,
+                        "highlights": highlights,
+                    }
+                )
+            )
+            response = _decode(_read_line(sock))
+    except (OSError, ValueError):
+        # No server, a stale socket, a server which does not answer within
+        # timeout, or an incomplete answer. Search without the server.
+        return None
+    if "error" in response:
+        print("Search-server:", response["error"], file=sys.stderr)
+        return None
+    return response["results"]
+
+
+def is_running(bib_dir):
+    socket_path = get_socket_path(bib_dir)
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def _encode(obj):
+    return json.dumps(obj).encode() + b"\n"
+
+
+def _decode(line):
+    return json.loads(line.decode())
+
+
+def _read_line(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(2**16)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if chunk.endswith(b"\n"):
+            break
+    return b"".join(chunks)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = _decode(line)
+            search = self.server.search
+            search.refresh()
+            results = search.search(
+                request["phrase"],
+                limit=request.get("limit", 10),
+                offset=request.get("offset", 0),
+                highlights=request.get("highlights", True),
+            )
+            response = {"results": results}
+        except Exception as err:
+            response = {"error": str(err)}
+        self.wfile.write(_encode(response))
+
+
+def serve(bib_dir):
+    """
+    Runs the search-server for bib_dir until interrupted.
+    The index is refreshed before each query, so changes made by
+    'bib update' or 'bib reindex' are seen by the next query.
+    """
+    from . import Index
+
+    socket_path = get_socket_path(bib_dir)
+    if os.path.exists(socket_path):
+        if is_running(bib_dir):
+            print("A server is already running on", socket_path)
+            return
+        os.remove(socket_path)
+
+    server = socketserver.UnixStreamServer(socket_path, _RequestHandler)
+    server.search = Index.Search(bib_dir=bib_dir)
+    print("Serve search on", socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.search.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,119 @@
+import os
+import stat
+
+
+class BibliographySnapshot:
+    """
+    The files of a bibliography at one point in time.
+
+    The bib_dir, its entry_dirs, and the 'original' and 'ocr' directories of
+    each entry_dir are read once with os.scandir. The listings and the
+    stat-results are kept so that status, update, and index can query the
+    snapshot instead of the filesystem.
+    Hidden files (starting with '.') are ignored just like glob does.
+    """
+
+    def __init__(self, bib_dir, entry_dirs=None):
+        """
+        Parameters
+        ----------
+        bib_dir : str
+                The bibliography directory.
+        entry_dirs : list of str (None)
+                When given, only these entry_dirs are read. Default is to
+                read all entry_dirs in bib_dir.
+        """
+        self.bib_dir = os.path.normpath(bib_dir)
+        self._stats = {}
+        self._listings = {}
+
+        if entry_dirs is None:
+            entry_names = self._scan_dir(self.bib_dir)
+            if entry_names is None:
+                entry_names = []
+        else:
+            entry_names = []
+            for entry_dir in entry_dirs:
+                entry_dir = os.path.normpath(entry_dir)
+                try:
+                    self._stats[entry_dir] = os.stat(entry_dir)
+                except FileNotFoundError:
+                    continue
+                entry_names.append(os.path.basename(entry_dir))
+            self._listings[self.bib_dir] = sorted(entry_names)
+
+        for entry_name in entry_names:
+            entry_dir = os.path.join(self.bib_dir, entry_name)
+            if self.isdir(entry_dir):
+                self._scan_entry_dir(entry_dir)
+
+    def _scan_dir(self, path):
+        names = []
+        try:
+            with os.scandir(path) as it:
+                for dir_entry in it:
+                    if str.startswith(dir_entry.name, "."):
+                        continue
+                    dir_entry_path = os.path.normpath(dir_entry.path)
+                    try:
+                        self._stats[dir_entry_path] = dir_entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    names.append(dir_entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        names.sort()
+        self._listings[os.path.normpath(path)] = names
+        return names
+
+    def _scan_entry_dir(self, entry_dir):
+        names = self._scan_dir(entry_dir)
+        if names is None:
+            return
+        for subdir in ["original", "ocr"]:
+            path = os.path.join(entry_dir, subdir)
+            if subdir in names and self.isdir(path):
+                self._scan_dir(path)
+
+    def stat(self, path):
+        """
+        Returns the stat-result of path, or None when path did not exist.
+        """
+        return self._stats.get(os.path.normpath(path), None)
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isdir(self, path):
+        st = self.stat(path)
+        if st is None:
+            return False
+        return stat.S_ISDIR(st.st_mode)
+
+    def getmtime(self, path):
+        return self._stats[os.path.normpath(path)].st_mtime
+
+    def getsize(self, path):
+        return self._stats[os.path.normpath(path)].st_size
+
+    def listdir(self, path):
+        """
+        Returns the sorted names in directory path, or an empty list when
+        path is not a directory.
+        """
+        return list(self._listings.get(os.path.normpath(path), []))
+
+    def list_entry_dirs(self):
+        return [
+            os.path.join(self.bib_dir, n) for n in self.listdir(self.bib_dir)
+        ]
+
+
+def make_entry_snapshot(entry_dir):
+    """
+    Returns a snapshot of only this entry_dir.
+    """
+    entry_dir = os.path.normpath(entry_dir)
+    return BibliographySnapshot(
+        bib_dir=os.path.dirname(entry_dir), entry_dirs=[entry_dir]
+    )
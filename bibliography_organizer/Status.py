@@ -1,7 +1,13 @@
 import os
-import glob
+import json
 from . import Entry
 from . import Bibtex
+from . import Snapshot
+from . import Bibliography
+from . import Dedup
+
+STATUS_CACHE_FILENAME = "status_cache.json"
+STATUS_CACHE_VERSION = 1
 
 
 def _has_upper_char(text):
@@ -67,17 +73,19 @@ def list_errors_in_bibtex_entry(bib_entry):
     return e
 
 
-def list_errors_in_entry(entry_dir):
+def list_errors_in_entry(entry_dir, snapshot=None):
     entry_dir = os.path.normpath(entry_dir)
+    if snapshot is None:
+        snapshot = Snapshot.make_entry_snapshot(entry_dir)
     opj = os.path.join
     e = []
-    if not os.path.isdir(entry_dir):
+    if not snapshot.isdir(entry_dir):
         e.append("E001:Entry is not a directory.")
 
     citekey = os.path.basename(entry_dir)
     e += list_errors_in_citekey(citekey=citekey)
 
-    if os.path.exists(opj(entry_dir, "reference.bib")):
+    if snapshot.exists(opj(entry_dir, "reference.bib")):
         try:
             bib = Bibtex.read(path=opj(entry_dir, "reference.bib"))
 
@@ -94,8 +102,10 @@ def list_errors_in_entry(entry_dir):
     else:
         e.append("E201:Entry has no 'reference.bib' file.")
 
-    if os.path.isdir(opj(entry_dir, "original")):
-        original_paths = Entry.list_original_paths(entry_dir)
+    if snapshot.isdir(opj(entry_dir, "original")):
+        original_paths = Entry.list_original_paths(
+            entry_dir, snapshot=snapshot
+        )
         if len(original_paths):
             orig_basenames = [os.path.basename(p) for p in original_paths]
             orig_basenames = [os.path.splitext(p)[0] for p in orig_basenames]
@@ -103,14 +113,14 @@ def list_errors_in_entry(entry_dir):
             if not citekey in orig_basenames:
                 e.append("E303:No original file with name of citekey.")
 
-            if os.path.exists(opj(entry_dir, "icon.jpg")):
-                if os.stat(opj(entry_dir, "icon.jpg")).st_size > 100e3:
+            if snapshot.exists(opj(entry_dir, "icon.jpg")):
+                if snapshot.getsize(opj(entry_dir, "icon.jpg")) > 100e3:
                     e.append("W402:Size of 'icon.jpg' > 100kB.")
             else:
                 e.append("W401:Entry has no 'icon.jpg'.")
 
-            if os.path.exists(opj(entry_dir, "ocr")):
-                ocrs = glob.glob(opj(entry_dir, "ocr", "*"))
+            if snapshot.exists(opj(entry_dir, "ocr")):
+                ocrs = snapshot.listdir(opj(entry_dir, "ocr"))
                 if not len(ocrs):
                     e.append("W502:'ocr' directory is empty.")
             else:
@@ -122,3 +132,114 @@ def list_errors_in_entry(entry_dir):
         e.append("E301:Entry has no 'original' directory.")
 
     return e
+
+
+def get_status_cache_path(bib_dir):
+    bib_dir = os.path.normpath(bib_dir)
+    return os.path.join(
+        bib_dir, Bibliography.HIDDEN_WORK_DIRNAME, STATUS_CACHE_FILENAME
+    )
+
+
+def fingerprint_entry(entry_dir, snapshot):
+    """
+    Returns the mtimes and sizes of the entry_dir and of everything in it
+    that the status depends on. When the fingerprint did not change, the
+    status of the entry did not change either.
+    """
+    entry_dir = os.path.normpath(entry_dir)
+    paths = [entry_dir]
+    for filename in snapshot.listdir(entry_dir):
+        paths.append(os.path.join(entry_dir, filename))
+    for subdir in ["original", "ocr"]:
+        for filename in snapshot.listdir(os.path.join(entry_dir, subdir)):
+            paths.append(os.path.join(entry_dir, subdir, filename))
+
+    fingerprint = []
+    for path in paths:
+        st = snapshot.stat(path)
+        if st is not None:
+            relpath = os.path.relpath(path, entry_dir)
+            fingerprint.append([relpath, st.st_mtime_ns, st.st_size])
+    return fingerprint
+
+
+def _read_status_cache(path):
+    try:
+        with open(path, "rt") as f:
+            cache = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if cache.get("version", None) != STATUS_CACHE_VERSION:
+        return {}
+    return cache["entries"]
+
+
+def _write_status_cache(path, entries):
+    tmp_path = path + ".part"
+    with open(tmp_path, "wt") as f:
+        f.write(
+            json.dumps({"version": STATUS_CACHE_VERSION, "entries": entries})
+        )
+    os.replace(tmp_path, path)
+
+
+def list_errors_in_bibliography(
+    bib_dir, snapshot=None, full=False, duplicates=False
+):
+    """
+    Yields (entry_dir, errors) for each entry in the bibliography.
+
+    The errors of each entry are stored in the status-cache in the hidden
+    work-dir together with the entry's fingerprint. Entries with unchanged
+    fingerprints are served from the status-cache.
+
+    Parameters
+    ----------
+    bib_dir : str
+            The bibliography directory.
+    snapshot : Snapshot.BibliographySnapshot (None)
+            When given, the entries are read from this snapshot.
+    full : bool (False)
+            Ignore the status-cache and check every entry again.
+    duplicates : bool (False)
+            Warn about near-duplicate originals across the bibliography,
+            see Dedup. These warnings are not cached as they depend on
+            other entries. The scan reads the signature-cache, and on a
+            cold cache every string-archive, before the first entry is
+            yielded.
+    """
+    bib_dir = os.path.normpath(bib_dir)
+    if snapshot is None:
+        snapshot = Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+
+    cache_path = get_status_cache_path(bib_dir)
+    use_cache = os.path.isdir(os.path.dirname(cache_path))
+    old_cache = {}
+    if use_cache and not full:
+        old_cache = _read_status_cache(cache_path)
+
+    duplicate_warnings = {}
+    if duplicates:
+        duplicate_warnings = Dedup.make_warnings(
+            Dedup.find_duplicates(bib_dir=bib_dir, snapshot=snapshot)
+        )
+
+    new_cache = {}
+    for entry_dir in snapshot.list_entry_dirs():
+        citekey = os.path.basename(entry_dir)
+        fingerprint = fingerprint_entry(entry_dir, snapshot=snapshot)
+
+        if (
+            citekey in old_cache
+            and old_cache[citekey]["fingerprint"] == fingerprint
+        ):
+            errors = old_cache[citekey]["errors"]
+        else:
+            errors = list_errors_in_entry(entry_dir, snapshot=snapshot)
+
+        new_cache[citekey] = {"fingerprint": fingerprint, "errors": errors}
+        yield entry_dir, errors + duplicate_warnings.get(entry_dir, [])
+
+    if use_cache:
+        _write_status_cache(cache_path, new_cache)
@@ -0,0 +1,387 @@
+"""
+Watches the bibliography and updates icons, optical-character-recognition,
+and the search-index of the entries which changed.
+
+Changes are noticed with inotify on Linux, and by polling elsewhere.
+"""
+
+import os
+import time
+import errno
+import queue
+import select
+import struct
+import threading
+from . import Bibliography
+from . import Snapshot
+
+# see inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Written by the update itself. Changes to these do not trigger updates.
+IGNORED_ENTRY_FILENAMES = ["icon.jpg", "ocr"]
+
+
+def _is_ignored_name(name):
+    return str.startswith(name, ".")
+
+
+class InotifyWatcher:
+    """
+    Watches the bib_dir, each entry_dir, and each entry's 'original'
+    directory with inotify.
+    """
+
+    def __init__(self, bib_dir):
+        import ctypes
+        import ctypes.util
+
+        self.bib_dir = os.path.normpath(bib_dir)
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._get_errno = ctypes.get_errno
+        self._paths = {}
+
+        self._add_watch(self.bib_dir)
+        for entry_dir in Bibliography.list_entry_dirs(bib_dir=self.bib_dir):
+            self._add_entry_watches(entry_dir)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(path), WATCH_MASK
+        )
+        if wd < 0:
+            err = self._get_errno()
+            if err in [errno.ENOENT, errno.ENOTDIR]:
+                return
+            raise OSError(err, os.strerror(err), path)
+        self._paths[wd] = path
+
+    def _add_entry_watches(self, entry_dir):
+        if os.path.isdir(entry_dir):
+            self._add_watch(entry_dir)
+            self._add_watch(os.path.join(entry_dir, "original"))
+
+    def _read_events(self):
+        try:
+            buff = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        i = 0
+        while i + EVENT_HEADER.size <= len(buff):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buff, i)
+            i += EVENT_HEADER.size
+            name = os.fsdecode(buff[i : i + length].rstrip(b"\0"))
+            i += length
+            yield wd, mask, name
+
+    def _entry_dir_of_event(self, wd, mask, name):
+        path = self._paths.get(wd, None)
+        if path is None:
+            return None
+        if path == self.bib_dir:
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) or _is_ignored_name(
+                name
+            ):
+                return None
+            entry_dir = os.path.join(self.bib_dir, name)
+            if mask & (IN_CREATE | IN_MOVED_TO) and mask & IN_ISDIR:
+                self._add_entry_watches(entry_dir)
+            return entry_dir
+
+        if os.path.dirname(path) == self.bib_dir:
+            entry_dir = path
+            if name in IGNORED_ENTRY_FILENAMES or _is_ignored_name(name):
+                return None
+            if name == "original" and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_watch(os.path.join(entry_dir, "original"))
+            return entry_dir
+
+        # the entry's 'original' directory
+        if _is_ignored_name(name):
+            return None
+        return os.path.dirname(path)
+
+    def wait(self, timeout=None):
+        """
+        Waits for changes and returns the set of entry_dirs which changed.
+        The set is empty when nothing changed within timeout seconds.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        changed = set()
+        if not readable:
+            return changed
+        for wd, mask, name in self._read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost. Consider all entries.
+                changed.update(
+                    Bibliography.list_entry_dirs(bib_dir=self.bib_dir)
+                )
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            entry_dir = self._entry_dir_of_event(wd, mask, name)
+            if entry_dir is not None:
+                changed.add(entry_dir)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def fingerprint_entry_originals(entry_dir, snapshot):
+    """
+    Returns the mtimes and sizes of the files in the entry_dir which the
+    update depends on. These are the originals, the 'reference.bib', and
+    the 'citekey_alias.txt'.
+    """
+    paths = []
+    for filename in snapshot.listdir(entry_dir):
+        if filename not in IGNORED_ENTRY_FILENAMES:
+            paths.append(os.path.join(entry_dir, filename))
+    for filename in snapshot.listdir(os.path.join(entry_dir, "original")):
+        paths.append(os.path.join(entry_dir, "original", filename))
+
+    fingerprint = []
+    for path in paths:
+        st = snapshot.stat(path)
+        if st is not None:
+            fingerprint.append((path, st.st_mtime_ns, st.st_size))
+    return fingerprint
+
+
+class PollingWatcher:
+    """
+    Scans the bibliography every interval seconds and compares the
+    fingerprints of its entries.
+    """
+
+    def __init__(self, bib_dir, interval=2.0):
+        self.bib_dir = os.path.normpath(bib_dir)
+        self.interval = interval
+        self._fingerprints = self._scan()
+        self._last_scan = time.monotonic()
+
+    def _scan(self):
+        snapshot = Snapshot.BibliographySnapshot(bib_dir=self.bib_dir)
+        fingerprints = {}
+        for entry_dir in snapshot.list_entry_dirs():
+            fingerprints[entry_dir] = fingerprint_entry_originals(
+                entry_dir=entry_dir, snapshot=snapshot
+            )
+        return fingerprints
+
+    def wait(self, timeout=None):
+        """
+        Waits for changes and returns the set of entry_dirs which changed.
+        The set is empty when nothing changed within timeout seconds.
+        """
+        start = time.monotonic()
+        while True:
+            next_scan = self._last_scan + self.interval
+            now = time.monotonic()
+            if timeout is not None and start + timeout < next_scan:
+                time.sleep(max([0.0, start + timeout - now]))
+                return set()
+            time.sleep(max([0.0, next_scan - now]))
+
+            fingerprints = self._scan()
+            self._last_scan = time.monotonic()
+            changed = set()
+            for entry_dir in set(fingerprints) | set(self._fingerprints):
+                if fingerprints.get(entry_dir) != self._fingerprints.get(
+                    entry_dir
+                ):
+                    changed.add(entry_dir)
+            self._fingerprints = fingerprints
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(bib_dir, polling=False, interval=2.0):
+    """
+    Returns an InotifyWatcher, or a PollingWatcher when polling is True or
+    when inotify is not available.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(bib_dir=bib_dir)
+        except (OSError, AttributeError) as err:
+            print("Can not use inotify:", err, "Poll for changes instead.")
+    return PollingWatcher(bib_dir=bib_dir, interval=interval)
+
+
+def watch(
+    bib_dir,
+    num_jobs=1,
+    debounce=2.0,
+    max_queue_size=16,
+    polling=False,
+    interval=2.0,
+    cache_dir=None,
+    verbose=False,
+    stop_event=None,
+):
+    """
+    Updates the icons, the optical-character-recognition, and the
+    search-index of the entries which change until interrupted.
+
+    On start, all entries are updated once to catch up with changes made
+    while not watching.
+
+    Parameters
+    ----------
+    bib_dir : str
+            The bibliography directory.
+    num_jobs : int (1)
+            Number of processes to recognize the pages of a document in.
+            The entries are updated one after another.
+    debounce : float (2.0)
+            An entry is updated only when there were no further changes
+            for this many seconds. This way a document is not read while
+            it is still being copied.
+    max_queue_size : int (16)
+            Max. number of entries waiting for their update. When full,
+            new changes are collected until the update caught up.
+    polling : bool (False)
+            If True, poll for changes even when inotify is available.
+    interval : float (2.0)
+            The interval in seconds to poll for changes in.
+    cache_dir : str (None)
+            See Bibliography.update_entries.
+    stop_event : threading.Event (None)
+            When given and set, watching stops.
+    """
+    bib_dir = os.path.normpath(bib_dir)
+    if stop_event is None:
+        stop_event = threading.Event()
+    work = queue.Queue(maxsize=max_queue_size)
+    worker = threading.Thread(
+        target=_update_worker,
+        kwargs={
+            "bib_dir": bib_dir,
+            "work": work,
+            "num_jobs": num_jobs,
+            "cache_dir": cache_dir,
+            "verbose": verbose,
+        },
+    )
+    worker.start()
+
+    watcher = make_watcher(bib_dir=bib_dir, polling=polling, interval=interval)
+    print("Watch", bib_dir)
+    pending = {}
+    for entry_dir in Bibliography.list_entry_dirs(bib_dir=bib_dir):
+        pending[entry_dir] = 0.0
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            for entry_dir in sorted(pending):
+                if now - pending[entry_dir] < debounce:
+                    continue
+                try:
+                    work.put(entry_dir, timeout=0.1)
+                except queue.Full:
+                    break
+                pending.pop(entry_dir)
+
+            if pending:
+                timeout = max([0.1, debounce - (now - max(pending.values()))])
+                timeout = min([timeout, debounce])
+            else:
+                timeout = 1.0
+            for entry_dir in watcher.wait(timeout=timeout):
+                pending[entry_dir] = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        _stop_worker(work=work, worker=worker)
+
+
+def _stop_worker(work, worker):
+    """
+    Drops the entries still waiting for their update, they are caught up
+    on the next start, and lets the worker finish its current entry.
+    Only this thread puts into work, so there is room for the stop-signal
+    once work is empty.
+    """
+    while True:
+        try:
+            work.get_nowait()
+        except queue.Empty:
+            break
+    work.put_nowait(None)
+    worker.join()
+
+
+def _update_worker(bib_dir, work, num_jobs, cache_dir, verbose):
+    from . import Index
+
+    pool = None
+    if num_jobs > 1:
+        pool = Bibliography.make_process_pool(num_jobs)
+
+    updated = []
+    stop = False
+    try:
+        while not stop:
+            entry_dir = work.get()
+            if entry_dir is None:
+                stop = True
+            elif entry_dir not in updated:
+                if os.path.isdir(entry_dir):
+                    try:
+                        Bibliography.update_entry(
+                            entry_dir=entry_dir,
+                            pool=pool,
+                            verbose=verbose,
+                            cache_dir=cache_dir,
+                            snapshot=None,
+                        )
+                    except Exception as err:
+                        print(os.path.basename(entry_dir), err)
+                updated.append(entry_dir)
+
+            # index in batches once the queue ran empty
+            if updated and (stop or work.empty()):
+                try:
+                    Index.increment_index(bib_dir=bib_dir, entry_dirs=updated)
+                except Exception as err:
+                    print("Can not update index:", err)
+                updated = []
+    finally:
+        if pool is not None:
+            pool.shutdown()
@@ -1,11 +1,38 @@
 """
 Organize your bibliography
+
+The submodules are imported when they are first accessed, e.g.
+bibliography_organizer.Index. This way commands which do not search, or
+read characters, do not pay for importing whoosh, pytesseract, and PIL.
 """
 
-from . import Reader
-from . import Index
-from . import Status
-from . import Entry
-from . import Bibtex
-from . import Document
-from . import Bibliography
+import importlib
+
+_SUBMODULES = [
+    "Reader",
+    "Index",
+    "Status",
+    "Entry",
+    "Bibtex",
+    "Document",
+    "Bibliography",
+    "OcrCache",
+    "Snapshot",
+    "Server",
+    "Watch",
+    "Profile",
+    "Dedup",
+    "OcrCheckpoint",
+]
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _SUBMODULES)
@@ -1,7 +1,11 @@
 import bibliography_organizer as biborg
 import argparse
+import json
+import sys
 import os
 
+OUTPUT_FORMATS = ["text", "json", "jsonl"]
+
 
 def is_bibliography_dir(bib_dir):
     return os.path.exists(
@@ -9,11 +13,52 @@ def is_bibliography_dir(bib_dir):
     )
 
 
-def print_warning_no_bibliography_dir(bib_dir):
+def print_warning_no_bibliography_dir(bib_dir, file=sys.stdout):
     print(
         "Missing ",
         os.path.join(bib_dir, biborg.Bibliography.HIDDEN_WORK_DIRNAME),
         "\nMaybe this is not a bibliography directory?",
+        file=file,
+    )
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(
+            "{:s} is not a positive integer.".format(text)
+        )
+    return value
+
+
+def print_records(records, output_format, file=sys.stdout):
+    """
+    Prints each record as soon as it is taken from the records.
+    With 'jsonl' each record is one line of json. With 'json' the records
+    are the items of one json-list, one item per line.
+    """
+    if output_format == "json":
+        file.write("[")
+    for i, record in enumerate(records):
+        line = json.dumps(record)
+        if output_format == "json":
+            line = ("\n" if i == 0 else ",\n") + line
+        else:
+            line += "\n"
+        file.write(line)
+        file.flush()
+    if output_format == "json":
+        file.write("\n]\n")
+        file.flush()
+
+
+def add_format_argument(command):
+    command.add_argument(
+        "--format",
+        dest="output_format",
+        choices=OUTPUT_FORMATS,
+        default="text",
+        help=("Print text, a json-list, or one json-record per line (jsonl)."),
     )
 
 
@@ -29,6 +74,17 @@ def main():
     )
 
     status = commands.add_parser("status", help="Print the status.")
+    status.add_argument(
+        "--full",
+        action="store_true",
+        help=("Ignore the cached status and check every entry again."),
+    )
+    status.add_argument(
+        "--duplicates",
+        action="store_true",
+        help=("Also look for near-duplicate originals across entries."),
+    )
+    add_format_argument(status)
 
     search = commands.add_parser("search", help="Search in full text.")
     search.add_argument(
@@ -39,6 +95,34 @@ def main():
             "The phrase to search for. Use AND, OR, NOT and parantheses ()."
         ),
     )
+    search.add_argument(
+        "--limit",
+        metavar="N",
+        type=positive_int,
+        default=10,
+        help=("The number of results to be printed."),
+    )
+    search.add_argument(
+        "--page",
+        metavar="P",
+        type=positive_int,
+        default=1,
+        help=("The page of results to be printed, starting at 1."),
+    )
+    search.add_argument(
+        "--highlights",
+        action="store_true",
+        help=("Also print the matching text of each result."),
+    )
+    add_format_argument(search)
+
+    serve = commands.add_parser(
+        "serve",
+        help=(
+            "Run a local search-server which keeps the search-index open. "
+            "'bib search' uses it when running."
+        ),
+    )
 
     update = commands.add_parser(
         "update",
@@ -47,6 +131,155 @@ def main():
             "icons, and search-index."
         ),
     )
+    update.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("The number of processes to run the OCR in."),
+    )
+    update.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Print the wall-time, cpu-time, and bytes of each stage, "
+            "and of the slowest entries and documents."
+        ),
+    )
+    update.add_argument(
+        "--profile-json",
+        metavar="PATH",
+        type=str,
+        help=("Write the record of each stage into this json-file."),
+    )
+    update.add_argument(
+        "--profile-trace",
+        metavar="PATH",
+        type=str,
+        help=(
+            "Write the stages into this file in the chrome-trace-format. "
+            "Open it in chrome://tracing or ui.perfetto.dev."
+        ),
+    )
+
+    watch = commands.add_parser(
+        "watch",
+        help=(
+            "Watch for changes and update the optical-character-recognition "
+            "(OCR), icons, and search-index of the changed entries."
+        ),
+    )
+    watch.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("The number of processes to run the OCR in."),
+    )
+    watch.add_argument(
+        "--debounce",
+        metavar="SECONDS",
+        type=float,
+        default=2.0,
+        help=("Wait until an entry did not change for this long."),
+    )
+    watch.add_argument(
+        "--polling",
+        action="store_true",
+        help=("Poll for changes instead of using inotify."),
+    )
+
+    reindex = commands.add_parser(
+        "reindex",
+        help=("Rebuild the search-index from scratch."),
+    )
+    reindex.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("The number of processes to index in."),
+    )
+    reindex.add_argument(
+        "--limitmb",
+        metavar="MB",
+        type=int,
+        default=128,
+        help=("The memory in MB for each process to buffer the index."),
+    )
+    reindex.add_argument(
+        "--per-page",
+        dest="per_page",
+        action="store_const",
+        const=True,
+        default=None,
+        help=("Index each page as its own document."),
+    )
+    reindex.add_argument(
+        "--per-document",
+        dest="per_page",
+        action="store_const",
+        const=False,
+        help=("Index each original as one document."),
+    )
+    reindex.add_argument(
+        "--store-content",
+        dest="store_content",
+        action="store_const",
+        const=True,
+        default=None,
+        help=("Store the text in the index."),
+    )
+    reindex.add_argument(
+        "--no-store-content",
+        dest="store_content",
+        action="store_const",
+        const=False,
+        help=(
+            "Do not store the text in the index. "
+            "Highlights are read from the ocr."
+        ),
+    )
+    reindex.add_argument(
+        "--collapse-duplicates",
+        dest="collapse_duplicates",
+        action="store_const",
+        const=True,
+        default=None,
+        help=("Index only one original of each set of near-duplicates."),
+    )
+    reindex.add_argument(
+        "--no-collapse-duplicates",
+        dest="collapse_duplicates",
+        action="store_const",
+        const=False,
+        help=("Index all originals, also near-duplicates."),
+    )
+
+    convert_ocr = commands.add_parser(
+        "convert-ocr",
+        help=(
+            "Rewrite the string-archives in 'ocr' in the current format, "
+            "which allows to read single pages."
+        ),
+    )
+    convert_ocr.add_argument(
+        "--compression",
+        choices=["none", "gzip", "zstd"],
+        default="none",
+        help=("Compress each page. 'zstd' needs the package zstandard."),
+    )
+    convert_ocr.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("The number of processes to convert in."),
+    )
 
     export_bibtex = commands.add_parser(
         "export-bibtex",
@@ -69,6 +302,14 @@ def main():
         "--citekey-alias",
         action="store_true",
     )
+    export_bibtex.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=("The number of processes to read changed reference.bib in."),
+    )
 
     args = parser.parse_args()
     bib_dir = os.getcwd()
@@ -77,38 +318,149 @@ def main():
         biborg.Bibliography.init(bib_dir=bib_dir)
 
     elif args.command == "status":
+        text = args.output_format == "text"
         if not is_bibliography_dir(bib_dir):
-            print_warning_no_bibliography_dir(bib_dir)
+            print_warning_no_bibliography_dir(
+                bib_dir, file=sys.stdout if text else sys.stderr
+            )
 
-        for entry_dir in biborg.Bibliography.list_entry_dirs(bib_dir=bib_dir):
-            biborg.Entry.print_status(entry_dir)
+        entries = biborg.Status.list_errors_in_bibliography(
+            bib_dir=bib_dir, full=args.full, duplicates=args.duplicates
+        )
+        if text:
+            for entry_dir, errors in entries:
+                biborg.Entry.print_status(entry_dir, errors=errors)
+        else:
+            print_records(
+                records=(
+                    record
+                    for entry_dir, errors in entries
+                    for record in biborg.Entry.make_status_records(
+                        entry_dir, errors=errors
+                    )
+                ),
+                output_format=args.output_format,
+            )
 
     elif args.command == "search":
+        text = args.output_format == "text"
         if not is_bibliography_dir(bib_dir):
-            print_warning_no_bibliography_dir(bib_dir)
+            print_warning_no_bibliography_dir(
+                bib_dir, file=sys.stdout if text else sys.stderr
+            )
             return
 
-        search_instance = biborg.Index.Search(bib_dir=bib_dir)
-        search_results = search_instance.search(args.phrase)
+        search_query = {
+            "limit": args.limit,
+            "offset": (args.page - 1) * args.limit,
+            "highlights": args.highlights,
+        }
+        search_results = biborg.Server.query(
+            bib_dir, args.phrase, **search_query
+        )
+        if search_results is None:
+            search_instance = biborg.Index.Search(bib_dir=bib_dir)
+            search_results = search_instance.search(
+                args.phrase, **search_query
+            )
+
+        if not text:
+            print_records(
+                records=search_results, output_format=args.output_format
+            )
+            return
 
         for search_result in search_results:
             entry_dir = os.path.join(bib_dir, search_result["citekey"])
             biborg.Entry.print_overview(
-                entry_dir, original_filename=search_result["original"]
+                entry_dir,
+                original_filename=search_result["original"],
+                page=search_result.get("page", None),
+                fields=search_result["fields"],
+                highlight=search_result.get("highlight", None),
             )
 
+    elif args.command == "serve":
+        if not is_bibliography_dir(bib_dir):
+            print_warning_no_bibliography_dir(bib_dir)
+            return
+
+        biborg.Server.serve(bib_dir=bib_dir)
+
     elif args.command == "update":
         if not is_bibliography_dir(bib_dir):
             print_warning_no_bibliography_dir(bib_dir)
             return
 
-        entry_dirs = biborg.Bibliography.list_entry_dirs(bib_dir=bib_dir)
-        for entry_dir in entry_dirs:
-            biborg.Entry.make_icon(entry_dir=entry_dir)
-            biborg.Entry.update_optical_character_recognition(
-                entry_dir=entry_dir
+        profile = args.profile or args.profile_json or args.profile_trace
+        if profile:
+            biborg.Profile.enable()
+
+        snapshot = biborg.Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+        biborg.Bibliography.update_entries(
+            entry_dirs=snapshot.list_entry_dirs(),
+            num_jobs=args.jobs,
+            cache_dir=biborg.OcrCache.get_cache_dir(bib_dir),
+            snapshot=snapshot,
+        )
+        biborg.Index.increment_index(bib_dir=bib_dir, num_procs=args.jobs)
+
+        if profile:
+            records = biborg.Profile.disable().records
+            if args.profile:
+                biborg.Profile.print_summary(records)
+            if args.profile_json:
+                biborg.Profile.write_json(args.profile_json, records)
+            if args.profile_trace:
+                biborg.Profile.write_chrome_trace(args.profile_trace, records)
+
+    elif args.command == "watch":
+        if not is_bibliography_dir(bib_dir):
+            print_warning_no_bibliography_dir(bib_dir)
+            return
+
+        biborg.Watch.watch(
+            bib_dir=bib_dir,
+            num_jobs=args.jobs,
+            debounce=args.debounce,
+            polling=args.polling,
+            cache_dir=biborg.OcrCache.get_cache_dir(bib_dir),
+        )
+
+    elif args.command == "reindex":
+        if not is_bibliography_dir(bib_dir):
+            print_warning_no_bibliography_dir(bib_dir)
+            return
+
+        size_before, size_after = biborg.Index.migrate_index(
+            bib_dir=bib_dir,
+            per_page=args.per_page,
+            store_content=args.store_content,
+            num_procs=args.jobs,
+            limitmb=args.limitmb,
+            collapse_duplicates=args.collapse_duplicates,
+        )
+        print(
+            "Size of index: {:.1f}MB -> {:.1f}MB".format(
+                size_before * 1e-6, size_after * 1e-6
             )
-        biborg.Index.increment_index(bib_dir=bib_dir)
+        )
+
+    elif args.command == "convert-ocr":
+        if not is_bibliography_dir(bib_dir):
+            print_warning_no_bibliography_dir(bib_dir)
+            return
+
+        snapshot = biborg.Snapshot.BibliographySnapshot(bib_dir=bib_dir)
+        num_converted = biborg.Bibliography.convert_string_archives(
+            entry_dirs=snapshot.list_entry_dirs(),
+            compression=(
+                None if args.compression == "none" else args.compression
+            ),
+            num_jobs=args.jobs,
+            snapshot=snapshot,
+        )
+        print("Converted {:d} string-archives.".format(num_converted))
 
     elif args.command == "export-bibtex":
         if not is_bibliography_dir(bib_dir):
@@ -124,13 +476,13 @@ def main():
         else:
             entry_fmt = None
 
-        bib_str = biborg.Bibtex.make_bib_file(
+        biborg.Bibtex.write_bib_file(
+            path=args.path,
             bib_dir=bib_dir,
             fmt=entry_fmt,
             citekey_alias=args.citekey_alias,
+            num_jobs=args.jobs,
         )
-        with open(args.path, "wt") as f:
-            f.write(bib_str)
 
 
 if __name__ == "__main__":
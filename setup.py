@@ -20,6 +20,7 @@ setuptools.setup(
     install_requires=[
         "minimal_bibtex_io_sebastian-achim-mueller",
         "pytesseract",
+        "Pillow",
         "whoosh",
     ],
     classifiers=[
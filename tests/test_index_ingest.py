@@ -0,0 +1,89 @@
+import bibliography_organizer as biborg
+import os
+import tracemalloc
+import whoosh.index
+import whoosh.qparser
+
+NUM_PAGES = 5000
+MARKER = "zzlastpagemarker"
+
+
+def make_archive(tmp_path, num_pages=NUM_PAGES):
+    # The path of a string-archive in the index is citekey/ocr/*.tar
+    ocr_dir = os.path.join(str(tmp_path), "book2020long", "ocr")
+    os.makedirs(ocr_dir)
+    path = os.path.join(ocr_dir, "book2020long.pdf.tar")
+    pages = {}
+    for page_number in range(1, num_pages + 1):
+        pages[page_number] = " ".join(
+            ["word{:d}".format((page_number * 7 + i) % 997) for i in range(40)]
+        )
+    pages[num_pages] += " " + MARKER
+    biborg.Reader.write_string_archive(path=path, pages=pages)
+    return path, sum([len(page) + 2 for page in pages.values()])
+
+
+def ingest(path, index_dir, per_page, **kwargs):
+    os.makedirs(index_dir)
+    index = whoosh.index.create_in(
+        index_dir, schema=biborg.Index.get_schema(per_page=per_page)
+    )
+    index_writer = biborg.Index.open_writer(index=index)
+    biborg.Index.add_doc(
+        index_writer=index_writer, path=path, modtime=0.0, **kwargs
+    )
+    index_writer.commit()
+    return index
+
+
+def count_hits(index, phrase):
+    with index.searcher() as searcher:
+        query = whoosh.qparser.QueryParser("content", index.schema).parse(
+            phrase
+        )
+        return len(searcher.search(query, limit=None))
+
+
+def test_ingest_5000_pages_per_document(tmp_path):
+    path, num_chars = make_archive(tmp_path)
+    index = ingest(path, os.path.join(str(tmp_path), "index"), False)
+    assert count_hits(index, MARKER) == 1
+    with index.searcher() as searcher:
+        assert searcher.doc_count() == 1
+
+
+def test_ingest_5000_pages_per_page(tmp_path):
+    path, num_chars = make_archive(tmp_path)
+    index = ingest(path, os.path.join(str(tmp_path), "index"), True)
+    assert count_hits(index, MARKER) == 1
+    with index.searcher() as searcher:
+        assert searcher.doc_count() == NUM_PAGES
+
+
+def test_join_pages_holds_one_copy_of_the_text(tmp_path):
+    path, num_chars = make_archive(tmp_path)
+    with biborg.Reader.open_string_archive(path) as arc:
+        tracemalloc.start()
+        try:
+            content, num_pages = biborg.Index._join_pages(
+                pages=biborg.Index._iter_pages(arc)
+            )
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    assert num_pages == NUM_PAGES
+    assert len(content) == num_chars
+    # The joined text, and the pages it is joined from.
+    assert peak < 3 * num_chars
+
+
+def test_ingest_limits_the_content_of_a_document(tmp_path):
+    path, num_chars = make_archive(tmp_path)
+    index = ingest(
+        path,
+        os.path.join(str(tmp_path), "index"),
+        False,
+        max_content_size=num_chars // 2,
+    )
+    assert count_hits(index, MARKER) == 0
+    assert count_hits(index, "word7") == 1
@@ -0,0 +1,110 @@
+import bibliography_organizer as biborg
+import contextlib
+import io
+import os
+import socketserver
+import threading
+
+
+def add_entry(bib_dir, citekey, text):
+    entry_dir = os.path.join(bib_dir, citekey)
+    os.makedirs(os.path.join(entry_dir, "original"))
+    os.makedirs(os.path.join(entry_dir, "ocr"))
+    with open(os.path.join(entry_dir, "reference.bib"), "wt") as f:
+        f.write(
+            "@article{" + citekey + ",\n"
+            "  title = {A title},\n"
+            "  author = {Doe, J},\n"
+            "  year = {2020},\n"
+            "}\n"
+        )
+    with open(
+        os.path.join(entry_dir, "original", citekey + ".pdf"), "wt"
+    ) as f:
+        f.write("1\n")
+    biborg.Reader.write_string_archive(
+        path=os.path.join(entry_dir, "ocr", citekey + ".pdf.tar"),
+        pages={1: text},
+    )
+
+
+def make_bibliography(tmp_path):
+    bib_dir = os.path.join(str(tmp_path), "bib")
+    os.makedirs(bib_dir)
+    add_entry(bib_dir, "doe2020first", "neutrino oscillation")
+    with contextlib.redirect_stdout(io.StringIO()):
+        biborg.Bibliography.init(bib_dir=bib_dir)
+    return bib_dir
+
+
+def increment_index(bib_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        biborg.Index.increment_index(bib_dir=bib_dir)
+
+
+def citekeys(results):
+    return sorted([result["citekey"] for result in results])
+
+
+def test_search_sees_changes_after_refresh(tmp_path):
+    bib_dir = make_bibliography(tmp_path)
+    search = biborg.Index.Search(bib_dir=bib_dir)
+    assert citekeys(search.search("neutrino")) == ["doe2020first"]
+
+    add_entry(bib_dir, "doe2021second", "neutrino mass")
+    increment_index(bib_dir)
+    search.refresh()
+    assert citekeys(search.search("neutrino")) == [
+        "doe2020first",
+        "doe2021second",
+    ]
+
+    add_entry(bib_dir, "doe2022third", "neutrino flux")
+    increment_index(bib_dir)
+    search.refresh()
+    assert len(search.search("neutrino")) == 3
+    search.close()
+
+
+def test_server_sees_changes_to_the_index(tmp_path):
+    bib_dir = make_bibliography(tmp_path)
+    socket_path = biborg.Server.get_socket_path(bib_dir)
+    server = socketserver.UnixStreamServer(
+        socket_path, biborg.Server._RequestHandler
+    )
+    server.search = biborg.Index.Search(bib_dir=bib_dir)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        results = biborg.Server.query(bib_dir, "neutrino")
+        assert citekeys(results) == ["doe2020first"]
+
+        add_entry(bib_dir, "doe2021second", "neutrino mass")
+        increment_index(bib_dir)
+        for repetition in range(2):
+            results = biborg.Server.query(bib_dir, "neutrino")
+            assert citekeys(results) == ["doe2020first", "doe2021second"]
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        server.search.close()
+        os.remove(socket_path)
+
+
+def test_query_returns_none_when_the_server_fails(tmp_path):
+    bib_dir = make_bibliography(tmp_path)
+    socket_path = biborg.Server.get_socket_path(bib_dir)
+    server = socketserver.UnixStreamServer(
+        socket_path, biborg.Server._RequestHandler
+    )
+    server.search = None
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert biborg.Server.query(bib_dir, "neutrino") is None
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        os.remove(socket_path)
@@ -0,0 +1,130 @@
+import bibliography_organizer as biborg
+import contextlib
+import io
+import os
+import stat
+import sys
+
+# Stand-ins for ImageMagick and tesseract. An original is a text-file with
+# the number of its pages in the first line. The images of the pages are
+# one-colored, tesseract reads the page-index from the color.
+CONVERT = """
+import re
+import sys
+from PIL import Image
+
+args = sys.argv[1:]
+scene = int(args[args.index("-scene") + 1]) if "-scene" in args else 0
+inp = [arg for arg in args if "[" in arg][0]
+out = args[-1]
+match = re.match(r"(.*)\\[(\\d+)(?:-(\\d+))?\\]$", inp)
+path, first = match.group(1), int(match.group(2))
+with open(path, "rt") as f:
+    num_pages = int(f.readline())
+last = num_pages - 1 if match.group(3) is None else int(match.group(3))
+if "-scene" not in args:
+    last = first
+if first >= num_pages:
+    sys.exit(1)
+for i, page in enumerate(range(first, min([last, num_pages - 1]) + 1)):
+    image_path = out % (scene + i) if "%" in out else out
+    Image.new("RGB", (64, 64), (page, 0, 0)).save(image_path, "PNG")
+"""
+
+IDENTIFY = """
+import sys
+
+with open(sys.argv[-1], "rt") as f:
+    num_pages = int(f.readline())
+print(num_pages)
+"""
+
+TESSERACT = """
+import sys
+from PIL import Image
+
+with Image.open(sys.argv[1]) as image:
+    page = image.convert("RGB").getpixel((0, 0))[0]
+with open(sys.argv[2] + ".txt", "wt") as f:
+    f.write("text of page {:d}\\n".format(round(page)))
+"""
+
+
+def write_tool(bin_dir, name, source):
+    path = os.path.join(bin_dir, name)
+    with open(path, "wt") as f:
+        f.write("#!" + sys.executable + "\n" + source)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+def install_stub_tools(tmp_path, monkeypatch):
+    bin_dir = os.path.join(str(tmp_path), "bin")
+    os.makedirs(bin_dir)
+    write_tool(bin_dir, "convert", CONVERT)
+    write_tool(bin_dir, "identify", IDENTIFY)
+    write_tool(bin_dir, "tesseract", TESSERACT)
+    # Without pdftotext, the originals have no text-layer.
+    monkeypatch.setenv("PATH", bin_dir)
+
+
+def add_entry(bib_dir, citekey, num_pages):
+    entry_dir = os.path.join(bib_dir, citekey)
+    os.makedirs(os.path.join(entry_dir, "original"))
+    with open(os.path.join(entry_dir, "reference.bib"), "wt") as f:
+        f.write("@article{" + citekey + ",\n  title = {A title},\n}\n")
+    with open(
+        os.path.join(entry_dir, "original", citekey + ".pdf"), "wt"
+    ) as f:
+        f.write("{:d}\n".format(num_pages))
+    return entry_dir
+
+
+def test_update_entries_in_parallel(tmp_path, monkeypatch):
+    install_stub_tools(tmp_path, monkeypatch)
+    bib_dir = os.path.join(str(tmp_path), "bib")
+    entry_dirs = []
+    for i in range(4):
+        entry_dirs.append(
+            add_entry(bib_dir, "doe202{:d}".format(i), num_pages=3 + i)
+        )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        biborg.Bibliography.update_entries(entry_dirs=entry_dirs, num_jobs=3)
+
+    for i, entry_dir in enumerate(entry_dirs):
+        citekey = os.path.basename(entry_dir)
+        assert os.path.isfile(os.path.join(entry_dir, "icon.jpg"))
+        pages = biborg.Reader.read_string_archive(
+            os.path.join(entry_dir, "ocr", citekey + ".pdf.tar")
+        )
+        assert len(pages) == 3 + i
+        for page_number in pages:
+            assert pages[page_number] == "text of page {:d}\n".format(
+                page_number - 1
+            )
+
+
+def test_document_to_string_archive_in_process_pool(tmp_path, monkeypatch):
+    install_stub_tools(tmp_path, monkeypatch)
+    document_path = os.path.join(str(tmp_path), "book.pdf")
+    with open(document_path, "wt") as f:
+        f.write("20\n")
+    out_path = os.path.join(str(tmp_path), "ocr", "book.pdf.tar")
+
+    with biborg.Bibliography.make_process_pool(3) as pool:
+        biborg.Reader.document_to_string_archive(
+            document_path=document_path,
+            out_path=out_path,
+            pool=pool,
+            chunk_size=4,
+            max_pages_in_flight=2,
+        )
+
+    pages = biborg.Reader.read_string_archive(out_path)
+    assert sorted(pages.keys()) == list(range(1, 21))
+    assert pages[20] == "text of page 19\n"
+
+
+def test_process_pool_does_not_fork():
+    with biborg.Bibliography.make_process_pool(2) as pool:
+        assert pool._mp_context.get_start_method() != "fork"